@@ -0,0 +1,202 @@
+import json
+import logging
+import os
+import re
+import time
+import warnings
+
+import numpy as np
+import rasterio
+from rasterio.errors import NotGeoreferencedWarning
+from rasterio.windows import Window
+
+from image_tag import TAG_PARAMS, contour_centroids, draw_label_image, mask_contours, point_order
+from image_tag import write_label_image, write_points_csv
+from obtain_reflectance import cube_shape, discover_image_ids, extract_reflectance, find_envi_header
+from obtain_reflectance import open_envi_memmap, parse_envi_header, read_coordinates, reflectance_cache_spec
+from obtain_reflectance import reflectance_paths, region_reflectance, save_reflectance
+from run_manifest import RunManifest
+
+# 获取全局logger
+logger = logging.getLogger("app_logger")
+
+# 高光谱立方体直接标注参数：mask_index为 "ndvi"（(NIR-Red)/(NIR+Red)）或 "ndre"（(NIR-RedEdge)/(NIR+RedEdge)），
+# 指数不低于对应阈值（ndvi_threshold / ndre_threshold）的像元视为叶片；各波段按中心波长（nm）选取最接近的波段。
+# 形态学与最小面积沿用 image_tag.TAG_PARAMS，中心点计算与排序与RGB标注完全一致
+CUBE_TAG_PARAMS = {
+    "mask_index": "ndvi",
+    "ndvi_threshold": 0.4,
+    "ndre_threshold": 0.2,
+    "red_nm": 670.0,
+    "edge_nm": 720.0,
+    "nir_nm": 800.0
+    }
+
+# 波段中心波长配置（ENVI头文件缺少wavelength字段时使用）
+BAND_WAVE_FILE = os.path.join("./sets", "sets_band_wave.json")
+
+
+def band_wavelengths(dat_path, band_file=BAND_WAVE_FILE):
+    """返回各波段中心波长（nm）：优先读取ENVI头文件的wavelength字段，否则读取波段配置文件"""
+    hdr_path = find_envi_header(dat_path)
+    if hdr_path is not None:
+        header = parse_envi_header(hdr_path)
+        values = [float(value) for value in re.findall(r"[-+]?\d*\.?\d+(?:[eE][-+]?\d+)?", header.get("wavelength", ""))]
+        if values and len(values) == int(header.get("bands", len(values))):
+            wavelengths = np.array(values)
+            # 以微米为单位时换算为纳米
+            if header.get("wavelength units", "").lower().startswith(("micro", "um", "µm")) or wavelengths.max() < 10:
+                wavelengths = wavelengths * 1000
+            return wavelengths
+    with open(band_file, "r", encoding="utf-8") as band_json:
+        band_wave = json.load(band_json)["band_wave"]
+    return np.array([band_wave[f"Band_{i + 1}"] for i in range(len(band_wave))], dtype=np.float64)
+
+
+def closest_band(wavelengths, target_nm, tolerance=5.0):
+    """返回最接近目标波长的波段下标（从0开始），波长差超过tolerance时记录警告"""
+    index = int(np.argmin(np.abs(wavelengths - target_nm)))
+    if abs(wavelengths[index] - target_nm) > tolerance:
+        logger.warning(
+                f"目标波长：{target_nm:.3f}nm 的最接近波段 Band_{index + 1} ({wavelengths[index]:.3f}nm) 超过限度。"
+                )
+    return index
+
+
+def read_band_planes(dat_path, band_indexes, backend="rasterio", block_rows=512):
+    """按行块窗口只读取指定的几个波段，返回形状为(波段, 行, 列)的float32数组"""
+    height, width = cube_shape(dat_path, backend)
+    planes = np.empty((len(band_indexes), height, width), dtype=np.float32)
+    if backend == "memmap":
+        cube, interleave = open_envi_memmap(dat_path)
+        for row_off in range(0, height, block_rows):
+            row_end = min(row_off + block_rows, height)
+            if interleave == "bsq":
+                planes[:, row_off:row_end] = cube[band_indexes, row_off:row_end, :]
+            elif interleave == "bil":
+                planes[:, row_off:row_end] = cube[row_off:row_end, band_indexes, :].transpose(1, 0, 2)
+            else:
+                planes[:, row_off:row_end] = cube[row_off:row_end, :, band_indexes].transpose(2, 0, 1)
+        return planes
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore", category=NotGeoreferencedWarning)
+        with rasterio.open(dat_path) as src:
+            indexes = [band_index + 1 for band_index in band_indexes]
+            for row_off in range(0, height, block_rows):
+                row_end = min(row_off + block_rows, height)
+                planes[:, row_off:row_end] = src.read(
+                        indexes, window=Window(0, row_off, width, row_end - row_off), out_dtype=np.float32
+                        )
+    return planes
+
+
+def vegetation_mask(dat_path, backend="rasterio"):
+    """按NDVI或红边指数阈值生成叶片二值掩膜（0/255），只读取计算指数所需的两个波段"""
+    mask_index = CUBE_TAG_PARAMS["mask_index"]
+    if mask_index not in ("ndvi", "ndre"):
+        raise ValueError(f"未知的掩膜指数：{mask_index}（可选：ndvi, ndre）")
+    wavelengths = band_wavelengths(dat_path)
+    low_nm = CUBE_TAG_PARAMS["red_nm"] if mask_index == "ndvi" else CUBE_TAG_PARAMS["edge_nm"]
+    low_band, nir_band = closest_band(wavelengths, low_nm), closest_band(wavelengths, CUBE_TAG_PARAMS["nir_nm"])
+    low, nir = read_band_planes(dat_path, [low_band, nir_band], backend)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        index = (nir - low) / (nir + low)
+    return np.where(index >= CUBE_TAG_PARAMS[f"{mask_index}_threshold"], 255, 0).astype(np.uint8)
+
+
+def cube_tag_params(sampling, min_points):
+    """处理清单记录的参数：分割参数、立方体掩膜参数与光谱提取方式"""
+    return {**TAG_PARAMS, **CUBE_TAG_PARAMS, "sampling": sampling, "min_points": min_points}
+
+
+def cube_tag_spec(image_id, output_base=".\\results", min_points=59, sampling="point"):
+    """返回处理清单所需的输入文件、输出文件与参数（输出含坐标文件与反射率结果）"""
+    inputs, outputs, _ = reflectance_cache_spec(image_id, output_base, min_points, sampling)
+    _, coord_csv, _ = reflectance_paths(image_id, output_base)
+    # 区域标签图由本阶段生成，不作为输入
+    inputs = [file_path for file_path in inputs if file_path != coord_csv and not file_path.endswith("_labels.png")]
+    outputs = [coord_csv] + outputs
+    if TAG_PARAMS["save_labels"]:
+        outputs.append(os.path.join(output_base, image_id, f"{image_id}_labels.png"))
+    return inputs, outputs, cube_tag_params(sampling, min_points)
+
+
+def tag_cube(image_id, output_base=".\\results", min_points=59, backend="rasterio", sampling="point"):
+    """
+    直接由高光谱立方体标注单个图像ID并提取反射率：植被指数掩膜 → 与RGB标注相同的中心点与排序 → 坐标文件与光谱。
+    坐标沿用RGB标注的约定（X、Y为立方体列、行号加1），结果可与 obtain_reflectance 的输出互换使用。
+    """
+    dat_path, coord_csv, output_csv = reflectance_paths(image_id, output_base)
+    summary = {"image_id": image_id, "points": 0, "csv_path": "", "error": None}
+    if not os.path.exists(dat_path):
+        summary["error"] = f"未找到.dat文件 {os.path.basename(dat_path)}"
+        return summary
+    try:
+        start_time = time.time()
+        mask = vegetation_mask(dat_path, backend)
+        contours = mask_contours(mask)
+        kept, centroids = contour_centroids(contours, TAG_PARAMS["min_area"])
+        point_index = point_order(centroids)
+        sorted_contours = [contours[kept[i]] for i in point_index]
+        points = [(i + 1, int(x) + 1, int(y) + 1) for i, (x, y) in enumerate(centroids[point_index])]
+        os.makedirs(os.path.dirname(coord_csv), exist_ok=True)
+        write_points_csv(coord_csv, points)
+        if TAG_PARAMS["save_labels"]:
+            # 与RGB标注的标签图对齐方式一致（整体偏移一个像元）
+            write_label_image(
+                    (mask.shape[0] + 1, mask.shape[1] + 1), [cnt + 1 for cnt in sorted_contours],
+                    os.path.join(output_base, image_id, f"{image_id}_labels.png")
+                    )
+        logger.info(f"{image_id} 立方体标注完成：{len(points)} 个点，耗时：{time.time() - start_time:.2f}秒")
+        summary.update(points=len(points), csv_path=coord_csv)
+
+        coordinates_df = read_coordinates(coord_csv, min_points, image_id)
+        if coordinates_df is None:
+            summary["error"] = f"坐标点不足{min_points}个"
+            return summary
+        if sampling == "region":
+            labels = draw_label_image(mask.shape, sorted_contours)
+            reflectance_results = region_reflectance(dat_path, coordinates_df, labels, image_id, backend)
+        else:
+            reflectance_results = extract_reflectance(dat_path, coordinates_df, image_id, backend=backend)
+        if reflectance_results is None or not save_reflectance(reflectance_results, output_csv, image_id):
+            summary["error"] = "反射率提取失败"
+    except Exception as e:
+        summary["error"] = str(e)
+    return summary
+
+
+def batch_tag_cubes(backend="rasterio", sampling="point", use_cache=True, min_points=59):
+    """
+    批量直接由高光谱立方体完成标注与反射率提取（不需要 ./images 中的RGB图像）。
+    use_cache为True时依据 results/.manifest.json 跳过输入与参数均未变化的ID。
+    """
+    image_ids = discover_image_ids()
+    logger.info(f"找到 {len(image_ids)} 个待标注数据立方体")
+    manifest = RunManifest(os.path.join(".\\results", ".manifest.json")) if use_cache else None
+
+    summaries = []
+    try:
+        for image_id in image_ids:
+            inputs, outputs, params = cube_tag_spec(image_id, min_points=min_points, sampling=sampling)
+            if manifest is not None and manifest.is_fresh("cube_tag", image_id, inputs, outputs, params):
+                logger.info(f"{image_id} 输入与参数未发生变化，沿用已有标注与反射率结果")
+                summaries.append({"image_id": image_id, "error": None, "skipped": True})
+                continue
+            summary = tag_cube(image_id, min_points=min_points, backend=backend, sampling=sampling)
+            if summary["error"]:
+                logger.error(f"{image_id} 立方体标注失败：{summary['error']}")
+            elif manifest is not None:
+                manifest.record("cube_tag", image_id, inputs, outputs, params, {"points": summary["points"]})
+            summaries.append(summary)
+    finally:
+        if manifest is not None:
+            manifest.save()
+
+    failed = [summary["image_id"] for summary in summaries if summary["error"]]
+    logger.info(f"立方体标注汇总：共 {len(summaries)} 个，成功 {len(summaries) - len(failed)} 个，失败 {len(failed)} 个")
+    return summaries
+
+
+if __name__ == "__main__":
+    batch_tag_cubes()
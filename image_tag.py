@@ -1,89 +1,223 @@
 import csv
 import logging
 import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import repeat
 
 import cv2
 import numpy as np
 
+from run_manifest import RunManifest
+
 logger = logging.getLogger("app_logger")
 
+# 分割参数（HSV阈值、形态学核大小、最小轮廓面积），同时作为处理清单中的参数记录；
+# pyramid_levels大于0时先在缩小2**pyramid_levels倍的图像上检测候选区域，再只在候选区域内按原分辨率分割，
+# pyramid_tile为合并候选区域的分块边长（原分辨率像素）；
+# save_labels为True时另存叶片区域标签图（uint16 PNG，像素值为点ID，0为背景），供反射率按区域统计
+TAG_PARAMS = {
+    "lower_white": [0, 0, 200],
+    "upper_white": [180, 30, 255],
+    "lower_green": [25, 40, 40],
+    "upper_green": [90, 255, 255],
+    "kernel_size": 5,
+    "close_iterations": 2,
+    "min_area": 10,
+    "pyramid_levels": 0,
+    "pyramid_tile": 256,
+    "save_labels": False
+    }
+
+# 校验图渲染参数：mode为 "off"（不生成）、"thumb"（缩略图）或 "full"（原分辨率）；
+# thumb_size为缩略图长边像素；png_compression为PNG压缩级别0-9（None时使用OpenCV默认设置）；
+# max_pending为后台写出线程允许积压的校验图数量（超出时等待最早的一张写完）
+RENDER_PARAMS = {
+    "mode": "full",
+    "thumb_size": 640,
+    "png_compression": None,
+    "max_pending": 4
+    }
+RENDER_MODES = ("off", "thumb", "full")
+
+# 每个进程一个后台写出线程及其未完成任务（进程池的工作进程各自惰性创建）
+_render_executor = None
+_render_pending = deque()
+
+
+def _reset_render_state():
+    """fork出的子进程不继承父进程的线程，需重新创建写出线程"""
+    global _render_executor, _render_pending
+    _render_executor = None
+    _render_pending = deque()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_render_state)
+
+
+def process_image(image_path, output_dir, render_mode=None):
+    """处理单个图像并保存结果（已修改排序逻辑）；校验图交由后台线程渲染，render_mode为"off"时不生成"""
+    render_mode = render_mode or RENDER_PARAMS["mode"]
+    if render_mode not in RENDER_MODES:
+        raise ValueError(f"未知的校验图模式：{render_mode}（可选：{', '.join(RENDER_MODES)}）")
 
-def process_image(image_path, output_dir):
-    """处理单个图像并保存结果（已修改排序逻辑）"""
     # 读取图像并转换颜色空间
     image = cv2.imread(image_path)
     if image is None:
         logger.warning(f"警告：无法读取图像 {image_path}")
         return [], "", ""
 
-    hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+    # Step 1-4: 检测黄绿色区域、形态学优化并提取轮廓（消除白色干扰只影响校验图，在渲染时进行）
+    if TAG_PARAMS["pyramid_levels"] > 0:
+        contours = pyramid_contours(image, TAG_PARAMS["pyramid_levels"], TAG_PARAMS["pyramid_tile"])
+    else:
+        contours = segment_contours(image)
+
+    # 全部轮廓的面积与中心点一次向量化计算
+    kept, centroids = contour_centroids(contours, TAG_PARAMS["min_area"])
+    valid_contours = [contours[i] for i in kept]
+
+    # Step 5: 排序：按列分组，每列从下到上
+    point_index = point_order(centroids)
+    sorted_points = centroids[point_index]
+
+    # 重新生成带序号的点集
+    points = [(i + 1, int(x), int(y)) for i, (x, y) in enumerate(sorted_points)]
+
+    # 生成输出路径
+    base_name = os.path.splitext(os.path.basename(image_path))[0]
+    output_img = os.path.join(output_dir, f"{base_name}_check1.png")
+    output_csv = os.path.join(output_dir, f"{base_name}_points.csv")
+
+    # 保存区域标签图（像素值与坐标文件中的ID一致）
+    if TAG_PARAMS["save_labels"]:
+        write_label_image(image.shape[:2], [valid_contours[i] for i in point_index],
+                          os.path.join(output_dir, f"{base_name}_labels.png"))
+
+    # 保存结果（校验图在后台线程中叠加、编码与写出）
+    if render_mode == "off":
+        output_img = ""
+    else:
+        submit_debug_image(image, valid_contours, output_img, render_mode)
+    write_points_csv(output_csv, points)
+
+    return points, output_img, output_csv
+
+
+def write_points_csv(output_csv, points):
+    """写出带序号的坐标文件（ID, X, Y）"""
+    with open(output_csv, 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(["ID", "X", "Y"])
+        for item in points:
+            writer.writerow(item)
+
+
+def segment_contours(image):
+    """按原分辨率分割：HSV阈值检测黄绿色区域、闭运算后提取外轮廓"""
+    return mask_contours(green_mask(image))
 
-    # Step 1: 消除白色干扰
-    lower_white = np.array([0, 0, 200])
-    upper_white = np.array([180, 30, 255])
-    white_mask = cv2.inRange(hsv, lower_white, upper_white)
-    image[white_mask == 255] = [0, 0, 0]
+
+def green_mask(image):
+    """HSV阈值检测黄绿色区域，返回原分辨率二值掩膜（0/255）"""
+    hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
 
     # Step 2: 检测黄绿色区域
-    lower_green = np.array([25, 40, 40])
-    upper_green = np.array([90, 255, 255])
-    green_mask = cv2.inRange(hsv, lower_green, upper_green)
+    lower_green = np.array(TAG_PARAMS["lower_green"])
+    upper_green = np.array(TAG_PARAMS["upper_green"])
+    return cv2.inRange(hsv, lower_green, upper_green)
+
 
+def mask_contours(mask):
+    """对二值掩膜做形态学闭运算并提取外轮廓（RGB与高光谱立方体两种标注方式共用）"""
     # Step 3: 形态学优化
-    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
-    closed_mask = cv2.morphologyEx(green_mask, cv2.MORPH_CLOSE, kernel, iterations=2)
+    kernel_size = TAG_PARAMS["kernel_size"]
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (kernel_size, kernel_size))
+    closed_mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel, iterations=TAG_PARAMS["close_iterations"])
 
     # Step 4: 轮廓检测
     contours, _ = cv2.findContours(closed_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    valid_contours = [cnt for cnt in contours if cv2.contourArea(cnt) > 10]
-
-    # Step 5: 计算中心点
-    points = []
-    for cnt in valid_contours:
-        list_moment = cv2.moments(cnt)
-        if list_moment["m00"] != 0:
-            cx = int(list_moment["m10"] / list_moment["m00"])
-            cy = int(list_moment["m01"] / list_moment["m00"])
-        else:
-            (cx, cy), _ = cv2.minEnclosingCircle(cnt)
-            cx, cy = int(cx), int(cy)
-        points.append((cx, cy))
-
-    # 新增排序逻辑：按列分组，每列从下到上排序
-    if points:
-        # 按X坐标排序初步分组
-        points_sorted = sorted(points, key=lambda p: p[0])
-
-        # 动态列分组（X坐标差超过20视为新列）
-        columns = []
-        current_col = [points_sorted[0]]
-        for p in points_sorted[1:]:
-            if abs(p[0] - current_col[-1][0]) > 20:
-                columns.append(current_col)
-                current_col = [p]
-            else:
-                current_col.append(p)
-        columns.append(current_col)
-
-        # 每列内部按Y从大到小排序（图像坐标系Y向下增大）
-        for col in columns:
-            col.sort(key=lambda p: -p[1])
-
-        # 合并所有点并重新编号
-        sorted_points = []
-        for col in columns:
-            sorted_points.extend(col)
-
-        # 重新生成带序号的点集
-        points = [(i + 1, x, y) for i, (x, y) in enumerate(sorted_points)]
-    else:
-        points = []
+    return contours
+
+
+def candidate_regions(mask, levels, tile):
+    """
+    在金字塔粗分辨率层上检测候选区域，返回 (缩放倍数, 粗分辨率标签图, 标签所属分组, 各分组的原分辨率ROI)。
+    粗层由原分辨率掩膜按 2**levels 见方取最大值池化得到，任一绿色像元所在的粗像元必为候选，候选区域是整图结果的超集。
+    候选区域按闭运算影响范围膨胀后标记连通域，每个连通域归属其外接框左上角所在的分块，同一分块的外接框合并为一个ROI。
+    """
+    factor = 2 ** levels
+    height, width = mask.shape[:2]
+    coarse_h, coarse_w = -(-height // factor), -(-width // factor)
+    # 以左上角为锚点膨胀后按步长取样即为最大值池化（图像外的像元不参与，末行末列不足 factor 时同样成立）
+    pool_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (factor, factor))
+    coarse_mask = np.ascontiguousarray(cv2.dilate(mask, pool_kernel, anchor=(0, 0))[::factor, ::factor])
+
+    # 闭运算半径R：轮廓像元距绿色像元不超过R，且其结果取决于2R范围内的像元，ROI需覆盖绿色像元外3R+1
+    reach = 3 * (TAG_PARAMS["kernel_size"] // 2) * TAG_PARAMS["close_iterations"] + 1
+    radius = -(-reach // factor)
+    coarse_mask = cv2.dilate(coarse_mask, cv2.getStructuringElement(cv2.MORPH_RECT, (2 * radius + 1, 2 * radius + 1)))
+    count, labels, stats, _ = cv2.connectedComponentsWithStats(coarse_mask, connectivity=8)
+
+    # 按分块合并外接框
+    tile_cells = max(1, tile // factor)
+    stats = stats[1:]
+    owner = (stats[:, 1] // tile_cells) * (-(-coarse_w // tile_cells)) + stats[:, 0] // tile_cells
+    order = np.argsort(owner, kind="stable")
+    starts = np.flatnonzero(np.concatenate([[True], np.diff(owner[order]) != 0])) if len(order) else order
+    group = np.full(count, -1, dtype=np.int64)
+    group[order + 1] = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, len(order))))
+    rois = np.empty((len(starts), 4), dtype=np.int64)
+    if len(starts):
+        x0, y0 = stats[order, 0], stats[order, 1]
+        rois[:, 0] = np.minimum.reduceat(x0, starts) * factor
+        rois[:, 1] = np.minimum.reduceat(y0, starts) * factor
+        # 末行末列的粗像元可能不足 factor 个原像元
+        rois[:, 2] = np.minimum(np.maximum.reduceat(x0 + stats[order, 2], starts) * factor, width)
+        rois[:, 3] = np.minimum(np.maximum.reduceat(y0 + stats[order, 3], starts) * factor, height)
+    return factor, labels, group, rois
 
-    # 生成调试图像
-    debug_image = image.copy()
+
+def pyramid_contours(image, levels, tile, max_coverage=0.5):
+    """
+    由粗到细分割：原分辨率掩膜只计算一次，形态学与轮廓提取只在候选ROI内进行并映射回原图坐标，结果与整图分割一致。
+    ROI可能相互重叠，轮廓按首个顶点所在粗像元的连通域归属去重；ROI总面积超过max_coverage，
+    或出现不属于任何候选区域的轮廓时（不应发生，作为保护）直接整图分割。
+    """
+    mask = green_mask(image)
+    factor, labels, group, rois = candidate_regions(mask, levels, tile)
+    height, width = image.shape[:2]
+    if np.prod(rois[:, 2:] - rois[:, :2], axis=1).sum() > max_coverage * height * width:
+        return mask_contours(mask)
+    contours = []
+    for index, (x0, y0, x1, y1) in enumerate(rois):
+        roi_contours = mask_contours(mask[y0:y1, x0:x1])
+        if not roi_contours:
+            continue
+        first = np.array([cnt[0, 0] for cnt in roi_contours]) + (x0, y0)
+        owner = labels[first[:, 1] // factor, first[:, 0] // factor]
+        if not owner.all():
+            logger.warning("金字塔分割出现不属于任何候选区域的轮廓，改为整图分割")
+            return mask_contours(mask)
+        owned = group[owner] == index
+        contours.extend(roi_contours[i] + np.array([x0, y0], dtype=np.int32) for i in np.flatnonzero(owned))
+    return contours
+
+
+def render_debug_image(image, contours, output_img, render_mode):
+    """消除原图中的白色干扰、半透明叠加保留的轮廓并写出PNG（缩略图模式下先缩小图像与轮廓）"""
+    if render_mode == "thumb":
+        scale = min(1.0, RENDER_PARAMS["thumb_size"] / max(image.shape[:2]))
+        if scale < 1.0:
+            image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            contours = [np.round(cnt * scale).astype(np.int32) for cnt in contours]
+    # 消除白色干扰
+    hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+    image[cv2.inRange(hsv, np.array(TAG_PARAMS["lower_white"]), np.array(TAG_PARAMS["upper_white"])) == 255] = 0
     overlay = image.copy()
-    cv2.drawContours(overlay, valid_contours, -1, (0, 255, 0), -1)
-    cv2.addWeighted(overlay, 0.3, debug_image, 0.7, 0, debug_image)
+    cv2.drawContours(overlay, contours, -1, (0, 255, 0), -1)
+    cv2.addWeighted(overlay, 0.3, image, 0.7, 0, overlay)
     """
     # 绘制序号和点（使用排序后的顺序）
     for idx, (x, y) in enumerate(sorted_points, 1):  # start=1
@@ -93,45 +227,255 @@ def process_image(image_path, output_dir):
                 cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2
                 )
     """
-    # 生成输出路径
-    base_name = os.path.splitext(os.path.basename(image_path))[0]
-    output_img = os.path.join(output_dir, f"{base_name}_check1.png")
-    output_csv = os.path.join(output_dir, f"{base_name}_points.csv")
+    compression = RENDER_PARAMS["png_compression"]
+    encode_params = [] if compression is None else [cv2.IMWRITE_PNG_COMPRESSION, int(compression)]
+    if not cv2.imwrite(output_img, overlay, encode_params):
+        raise OSError(f"校验图写入失败：{output_img}")
+    return output_img
 
-    # 保存结果
-    cv2.imwrite(output_img, debug_image)
-    with open(output_csv, 'w', newline='') as csvfile:
-        writer = csv.writer(csvfile)
-        writer.writerow(["ID", "X", "Y"])
-        for item in points:
-            writer.writerow(item)
 
-    return points, output_img, output_csv
+def submit_debug_image(image, contours, output_img, render_mode):
+    """将校验图交给后台写出线程；积压超过max_pending时先等待最早的任务完成（提供背压）"""
+    global _render_executor
+    if _render_executor is None:
+        _render_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="debug_render")
+    while len(_render_pending) >= max(1, RENDER_PARAMS["max_pending"]):
+        wait_debug_image(_render_pending.popleft())
+    _render_pending.append(_render_executor.submit(render_debug_image, image, contours, output_img, render_mode))
+
+
+def wait_debug_image(future):
+    """等待单张校验图写出；失败只记录警告并返回错误信息，不影响坐标结果"""
+    try:
+        future.result()
+    except Exception as e:
+        logger.warning(f"校验图生成失败：{str(e)}")
+        return str(e)
+    return None
+
+
+def flush_debug_images():
+    """等待本进程中全部校验图写出完成，返回失败任务的错误信息列表"""
+    errors = []
+    while _render_pending:
+        error = wait_debug_image(_render_pending.popleft())
+        if error:
+            errors.append(error)
+    return errors
+
+
+def contour_centroids(contours, min_area):
+    """
+    向量化计算全部轮廓的多边形面积与质心（与cv2.contourArea/cv2.moments一致），
+    返回面积大于min_area的轮廓下标与 (N, 2) 的 (x, y) 中心点。
+    顶点为整数，鞋带公式的2倍面积与6倍一阶矩按整数精确累加，中心点向下取整。
+    """
+    if len(contours) == 0:
+        return np.empty(0, dtype=np.int64), np.empty((0, 2), dtype=np.int64)
+    lengths = np.array([len(cnt) for cnt in contours])
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    vertices = np.concatenate(contours).reshape(-1, 2).astype(np.int64)
+    # 每个顶点的下一个顶点（轮廓末点回到首点）
+    next_index = np.arange(len(vertices)) + 1
+    next_index[starts + lengths - 1] = starts
+    x, y = vertices[:, 0], vertices[:, 1]
+    x_next, y_next = x[next_index], y[next_index]
+    cross = x * y_next - x_next * y
+    area2 = np.add.reduceat(cross, starts)
+    moment_x6 = np.add.reduceat((x + x_next) * cross, starts)
+    moment_y6 = np.add.reduceat((y + y_next) * cross, starts)
+    # 顺时针轮廓三者同号，统一为正
+    sign = np.sign(area2)
+    area2, moment_x6, moment_y6 = area2 * sign, moment_x6 * sign, moment_y6 * sign
+    kept = np.flatnonzero(area2 > 2 * min_area)
+    centroids = np.column_stack([moment_x6[kept] // (3 * area2[kept]), moment_y6[kept] // (3 * area2[kept])])
+    return kept, centroids
+
+
+def point_order(points, column_gap=20):
+    """返回点的排序下标：按X排序后X坐标差超过column_gap视为新列，列内按Y从大到小（从下到上）排序"""
+    if len(points) == 0:
+        return np.empty(0, dtype=np.int64)
+    by_x = np.argsort(points[:, 0], kind="stable")
+    column = np.concatenate([[0], np.cumsum(np.diff(points[by_x, 0]) > column_gap)])
+    return by_x[np.lexsort((-points[by_x, 1], column))]
+
+
+def draw_label_image(shape, sorted_contours):
+    """按排序后的顺序填充轮廓，返回以点ID为像素值的uint16标签图"""
+    if len(sorted_contours) > np.iinfo(np.uint16).max:
+        raise ValueError(f"区域数量超过标签图上限：{len(sorted_contours)}")
+    labels = np.zeros(shape, dtype=np.uint16)
+    for region_id, cnt in enumerate(sorted_contours, 1):
+        cv2.drawContours(labels, [cnt], -1, region_id, -1)
+    return labels
+
+
+def write_label_image(shape, sorted_contours, output_labels):
+    """写出以点ID为像素值的uint16标签图"""
+    labels = draw_label_image(shape, sorted_contours)
+    if not cv2.imwrite(output_labels, labels):
+        raise OSError(f"标签图写入失败：{output_labels}")
+    return output_labels
+
+
+def list_image_files(input_dir="./images"):
+    """按文件名顺序列出待处理的PNG图像"""
+    return sorted(f for f in os.listdir(input_dir) if f.lower().endswith('.png'))
+
+
+def tag_single_image(filename, input_dir="./images", output_base="./results", render_mode=None, wait_render=False):
+    """
+    处理单个图像文件并返回结果摘要（异常在此捕获，单张失败不影响其余图像）。
+    wait_render为True时（进程池的工作进程中）等待本图校验图写出，写出失败时摘要不再给出校验图路径并记录原因。
+    """
+    image_id = os.path.splitext(filename)[0]
+    image_path = os.path.join(input_dir, filename)
+    summary = {"filename": filename, "image_id": image_id, "points": 0, "img_path": "", "csv_path": "", "error": None}
+    try:
+        # 创建输出目录
+        output_dir = os.path.join(output_base, image_id)
+        os.makedirs(output_dir, exist_ok=True)
+
+        # 处理图像
+        points, img_path, csv_path = process_image(image_path, output_dir, render_mode)
+        if not csv_path:
+            summary["error"] = "无法读取图像"
+        summary.update(points=len(points), img_path=img_path, csv_path=csv_path)
+    except Exception as e:
+        summary["error"] = str(e)
+    if wait_render:
+        render_errors = flush_debug_images()
+        if render_errors:
+            summary.update(img_path="", render_error="；".join(render_errors))
+    return summary
+
+
+def tag_output_paths(filename, input_dir="./images", output_base="./results"):
+    """
+    返回单张图像的输入路径、坐标文件路径与校验图路径。
+    处理清单不跟踪校验图：校验图为可选的调试输出，由后台线程异步写出。
+    """
+    image_id = os.path.splitext(filename)[0]
+    output_dir = os.path.join(output_base, image_id)
+    return (
+        os.path.join(input_dir, filename),
+        os.path.join(output_dir, f"{image_id}_points.csv"),
+        os.path.join(output_dir, f"{image_id}_check1.png")
+        )
+
+
+def tracked_tag_outputs(filename, output_base="./results"):
+    """处理清单跟踪的输出文件：坐标文件，以及开启save_labels时的区域标签图"""
+    image_id = os.path.splitext(filename)[0]
+    output_dir = os.path.join(output_base, image_id)
+    outputs = [os.path.join(output_dir, f"{image_id}_points.csv")]
+    if TAG_PARAMS["save_labels"]:
+        outputs.append(os.path.join(output_dir, f"{image_id}_labels.png"))
+    return outputs
+
+
+def cached_tag_summary(filename, manifest, input_dir="./images", output_base="./results"):
+    """若图像及其结果与处理清单一致，返回跳过处理的结果摘要，否则返回None"""
+    image_path, csv_path, img_path = tag_output_paths(filename, input_dir, output_base)
+    image_id = os.path.splitext(filename)[0]
+    outputs = tracked_tag_outputs(filename, output_base)
+    if not manifest.is_fresh("image_tag", image_id, [image_path], outputs, TAG_PARAMS):
+        return None
+    return {
+        "filename": filename, "image_id": image_id, "points": manifest.get_meta("image_tag", image_id).get("points", 0),
+        "csv_path": csv_path, "img_path": img_path if os.path.exists(img_path) else "", "error": None, "skipped": True
+        }
+
+
+def record_tag_summary(summary, manifest, input_dir="./images", output_base="./results"):
+    """将成功处理的图像写入处理清单"""
+    if summary["error"] or summary.get("skipped"):
+        return
+    image_path, _, _ = tag_output_paths(summary["filename"], input_dir, output_base)
+    outputs = tracked_tag_outputs(summary["filename"], output_base)
+    manifest.record(
+            "image_tag", summary["image_id"], [image_path], outputs, TAG_PARAMS, {"points": summary["points"]}
+            )
 
 
-def batch_process_images():
+def log_tag_summary(summary):
+    """输出单张图像的处理结果"""
+    if summary["error"]:
+        logger.error(f"文件：{summary['filename']}处理失败：{summary['error']}")
+        return
+    if summary.get("skipped"):
+        logger.info(f"文件：{summary['filename']}未发生变化，沿用已有结果（{summary['points']} 个点）。")
+        return
+    img_path = os.path.relpath(summary["img_path"]) if summary["img_path"] else "未生成"
+    if summary.get("render_error"):
+        logger.warning(f"文件：{summary['filename']}校验图生成失败：{summary['render_error']}")
+        img_path = "生成失败"
+    logger.info(
+            "\n" + "=" * 20 + f"\n文件：{summary['filename']}处理完成。\n本文件共检测到： {summary['points']} 个点。\n生成校验图路径："
+                              f"{img_path}\n提取坐标文件路径：{os.path.relpath(summary['csv_path'])}"
+            + "\n" + "=" * 20
+            )
+
+
+def batch_process_images(workers=1, use_cache=True, render_mode=None):
+    """
+    批量处理图像；workers大于1时使用进程池并行，日志按文件名顺序统一输出。
+    use_cache为True时依据 results/.manifest.json 跳过图像与参数均未变化的文件。
+    render_mode为校验图模式（"off"、"thumb"、"full"，None时使用RENDER_PARAMS["mode"]）。
+    """
     input_dir = "./images"
     output_base = "./results"
 
     if not os.path.exists(input_dir):
         logger.error(f"错误：输入目录 {input_dir} 不存在")
-        return
+        return []
+
+    filenames = list_image_files(input_dir)
+    workers = workers or os.cpu_count() or 1
+    manifest = RunManifest(os.path.join(output_base, ".manifest.json")) if use_cache else None
+
+    # 先在主进程中筛出需要重新处理的文件
+    cached = {}
+    if manifest is not None:
+        cached = {filename: cached_tag_summary(filename, manifest, input_dir, output_base) for filename in filenames}
+    pending = [filename for filename in filenames if not cached.get(filename)]
+
+    if workers > 1 and len(pending) > 1:
+        executor = ProcessPoolExecutor(max_workers=min(workers, len(pending)))
+        # map按提交顺序返回结果，保证日志顺序与串行模式一致；工作进程内等待校验图写出，失败原因随摘要返回
+        results = executor.map(
+                tag_single_image, pending, repeat(input_dir), repeat(output_base), repeat(render_mode), repeat(True)
+                )
+    else:
+        executor = None
+        results = (tag_single_image(filename, input_dir, output_base, render_mode) for filename in pending)
+
+    summaries = []
+    try:
+        for filename in filenames:
+            summary = cached.get(filename) or next(results)
+            log_tag_summary(summary)
+            if manifest is not None:
+                record_tag_summary(summary, manifest, input_dir, output_base)
+            summaries.append(summary)
+    finally:
+        # 工作进程中的校验图已随各自任务写出；本进程中的校验图在此统一等待
+        if executor is not None:
+            executor.shutdown()
+        flush_debug_images()
+        if manifest is not None:
+            manifest.save()
 
-    for filename in os.listdir(input_dir):
-        if filename.lower().endswith('.png'):
-            image_id = os.path.splitext(filename)[0]
-            image_path = os.path.join(input_dir, filename)
-
-            # 创建输出目录
-            output_dir = os.path.join(output_base, image_id)
-            os.makedirs(output_dir, exist_ok=True)
-
-            # 处理图像
-            points, img_path, csv_path = process_image(image_path, output_dir)
-            logger.info(
-                    "\n" + "=" * 20 + f"\n文件：{filename}处理完成。\n本文件共检测到： {len(points)} 个点。\n生成校验图路径："
-                                      f"{os.path.relpath(img_path)}\n提取坐标文件路径：{os.path.relpath(csv_path)}" + "\n" + "=" * 20
-                    )
+    failed = [summary["filename"] for summary in summaries if summary["error"]]
+    skipped = sum(1 for summary in summaries if summary.get("skipped"))
+    logger.info(
+            f"图像标注汇总：共 {len(summaries)} 张，成功 {len(summaries) - len(failed)} 张（其中跳过 {skipped} 张），"
+            f"失败 {len(failed)} 张"
+            )
+    if failed:
+        logger.warning(f"处理失败的文件：{', '.join(failed)}")
+    return summaries
 
 
 if __name__ == "__main__":
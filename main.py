@@ -1,9 +1,16 @@
 import logging
 import os
+import queue
+import threading
 import time
 
-from image_tag import batch_process_images  # 确保文件名为image_tag.py
+from cube_tag import batch_tag_cubes
+from image_tag import batch_process_images, cached_tag_summary, flush_debug_images, list_image_files, log_tag_summary
+from image_tag import record_tag_summary
+from image_tag import tag_single_image  # 确保文件名为image_tag.py
 from obtain_reflectance import batch_process as batch_process_reflectance  # 确保文件名为obtain_reflectance.py
+from obtain_reflectance import discover_image_ids, process_data
+from run_manifest import RunManifest
 
 
 # 配置日志系统
@@ -33,10 +40,9 @@ def setup_logger():
 logger = setup_logger()
 
 
-def main():
-    # 创建必要目录
-    os.makedirs("./images", exist_ok=True)
-    os.makedirs("./meta_data", exist_ok=True)
+def run_phased_pipeline():
+    """两阶段串行流程：全部图像标注完成后再统一提取反射率"""
+    phase1_time = phase2_time = 0.0
 
     # 阶段1: 图像标注处理
     logger.info("\n" + "=" * 40 + "\n阶段1：图像特征点提取" + "\n" + "=" * 40)
@@ -60,8 +66,103 @@ def main():
     except Exception as e:
         logger.error(f"阶段2处理失败: {str(e)}")
 
+    return phase1_time + phase2_time
+
+
+def run_cube_pipeline(sampling="point"):
+    """立方体直接标注流程：由NDVI/红边掩膜定位叶片，一次处理同时得到坐标与反射率（不需要RGB图像）"""
+    logger.info("\n" + "=" * 40 + "\n立方体直接标注与反射率提取" + "\n" + "=" * 40)
+    start_time = time.time()
+
+    try:
+        batch_tag_cubes(sampling=sampling)
+        logger.info(f"\n✅ 立方体标注完成 耗时: {time.time() - start_time:.1f}秒")
+    except Exception as e:
+        logger.error(f"立方体标注失败: {str(e)}")
+
+    return time.time() - start_time
+
+
+def run_streaming_pipeline(queue_size=2, use_cache=True):
+    """流式流程：每个图像ID标注完成、坐标文件生成后立即进入反射率提取（有界队列提供背压）"""
+    logger.info("\n" + "=" * 40 + "\n流式处理：图像标注 → 反射率提取" + "\n" + "=" * 40)
+    pipeline_start = time.time()
+    id_queue = queue.Queue(maxsize=queue_size)
+    stage_times = {}
+    # 两个阶段共用同一份处理清单，跳过内容与参数均未变化的ID
+    manifest = RunManifest("./results/.manifest.json") if use_cache else None
+
+    def tagging_worker():
+        """生产者：逐张标注图像，成功后将image_id放入队列（队列满时阻塞）"""
+        try:
+            for filename in list_image_files():
+                start_time = time.time()
+                summary = cached_tag_summary(filename, manifest) if manifest is not None else None
+                summary = summary or tag_single_image(filename)
+                log_tag_summary(summary)
+                if manifest is not None:
+                    record_tag_summary(summary, manifest)
+                stage_times[summary["image_id"]] = {"tag": time.time() - start_time}
+                if not summary["error"]:
+                    id_queue.put(summary["image_id"])
+        except Exception as e:
+            logger.error(f"图像标注线程失败: {str(e)}")
+        finally:
+            id_queue.put(None)
+
+    def extract(image_id):
+        """消费者：提取单个图像ID的反射率并记录阶段耗时"""
+        start_time = time.time()
+        try:
+            process_data(image_id, manifest=manifest)
+        except Exception as e:
+            logger.error(f"反射率提取失败 {image_id}: {str(e)}")
+        timing = stage_times.setdefault(image_id, {})
+        timing["refl"] = time.time() - start_time
+        timing["done"] = time.time() - pipeline_start
+
+    if os.path.exists("./images"):
+        producer = threading.Thread(target=tagging_worker, name="image_tagging", daemon=True)
+        producer.start()
+        while (image_id := id_queue.get()) is not None:
+            extract(image_id)
+        producer.join()
+        flush_debug_images()
+    else:
+        logger.error("错误：输入目录 ./images 不存在")
+
+    # 补充处理：本次未标注但已存在.dat文件的ID（坐标文件可能来自历史运行）
+    for image_id in discover_image_ids():
+        if "refl" not in stage_times.get(image_id, {}):
+            extract(image_id)
+    if manifest is not None:
+        manifest.save()
+
+    # 按ID输出各阶段耗时
+    for image_id, timing in sorted(stage_times.items()):
+        logger.info(
+                f"⏱ {image_id} | 标注: {timing.get('tag', 0.0):.2f}秒 | 提取: {timing.get('refl', 0.0):.2f}秒 | "
+                f"完成时刻: {timing.get('done', 0.0):.2f}秒"
+                )
+    finished = [timing["done"] for timing in stage_times.values() if "done" in timing]
+    if finished:
+        logger.info(f"首个结果延迟: {min(finished):.2f}秒")
+    return time.time() - pipeline_start
+
+
+def main(pipe_mode="stream"):
+    # 创建必要目录
+    os.makedirs("./images", exist_ok=True)
+    os.makedirs("./meta_data", exist_ok=True)
+
+    if pipe_mode == "phase":
+        total_time = run_phased_pipeline()
+    elif pipe_mode == "cube":
+        total_time = run_cube_pipeline()
+    else:
+        total_time = run_streaming_pipeline()
+
     # 最终统计
-    total_time = phase1_time + phase2_time
     logger.info("\n" + "=" * 40 + f"\n🏁 全部处理完成 | 总耗时: {total_time:.1f}秒" + "\n" + "=" * 40 + "\n")
 
 
@@ -6,30 +6,76 @@ import logging as log
 import sys
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
-from scipy.stats import pearsonr, spearmanr
+from scipy.stats import rankdata
+from scipy.stats import t as t_dist
+
+
+class BatchCorrelationEngine:
+    """
+    批量相关性计算引擎：一次NumPy运算得到全部特征列与目标列的相关系数及p值。
+    Pearson 对全部列只做一次标准化；Spearman 对全部列只做一次秩变换，再复用Pearson计算。
+    Batched correlation engine: computes r and p-values of every feature column against the target in one NumPy
+    pass. Pearson standardizes all columns once; Spearman ranks all columns once and reuses the Pearson kernel.
+    """
+
+    def __init__(self, use_flt32: bool = False):
+        # 计算精度（float32可减少内存占用与带宽，p值始终以float64计算）
+        self.data_type = np.float32 if use_flt32 else np.float64
+
+    def _standardize(self, data_matx):
+        """按列去均值并归一化为单位范数"""
+        data_matx = np.asarray(data_matx, dtype=self.data_type)
+        cent_matx = data_matx - data_matx.mean(axis=0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return cent_matx / np.linalg.norm(cent_matx, axis=0)
+
+    @staticmethod
+    def _p_value(corr_vect, samp_numb):
+        """双侧t检验p值（与scipy.stats.pearsonr / spearmanr 的检验等价）"""
+        corr_vect = np.clip(np.asarray(corr_vect, dtype=np.float64), -1.0, 1.0)
+        free_degr = samp_numb - 2
+        with np.errstate(invalid="ignore", divide="ignore"):
+            t_stat = corr_vect * np.sqrt(free_degr / ((1.0 - corr_vect) * (1.0 + corr_vect)))
+        return 2 * t_dist.sf(np.abs(t_stat), free_degr)
+
+    def pearson(self, feat_matx, targ_vect):
+        """计算每个特征列与目标向量的Pearson相关系数及p值"""
+        feat_stdz = self._standardize(feat_matx)
+        targ_stdz = self._standardize(np.reshape(targ_vect, (-1, 1)))[:, 0]
+        corr_vect = targ_stdz @ feat_stdz
+        return corr_vect.astype(np.float64), self._p_value(corr_vect, feat_stdz.shape[0])
+
+    def spearman(self, feat_matx, targ_vect):
+        """计算每个特征列与目标向量的Spearman秩相关系数及p值"""
+        rank_matx = rankdata(np.asarray(feat_matx, dtype=np.float64), axis=0)
+        rank_targ = rankdata(np.asarray(targ_vect, dtype=np.float64))
+        return self.pearson(rank_matx, rank_targ)
+
+    @staticmethod
+    def numeric_columns(band_data):
+        """提取数据表中的数值列"""
+        return band_data.select_dtypes(include="number")
 
 
 class PearsonCorrelationAnalysis:
-    def __init__(self):
+    def __init__(self, data_ctxt=None):
+        # 共享数据集上下文（未传入时单独创建）
+        data_ctxt = data_ctxt or CorrelationDatasetContext()
         # 初始化基础路径（获取项目根目录的父级目录）
-        self.base_path = Path(sys.argv[0]).resolve().parent.parent
+        self.base_path = data_ctxt.base_path
         # 初始化日志管理系统
-        self.root_logg = BandCorrelationAnalysis().root_logg
-        self.band_data = BandCorrelationAnalysis().band_data
-
-    @staticmethod
-    def analysis_calculation(data_comx, data_comy):
-        pearson_corr, pearson_p = pearsonr(data_comy, data_comx)
-        return pearson_corr, pearson_p
+        self.root_logg = data_ctxt.root_logg
+        self.band_data = data_ctxt.band_data
+        self.corr_engi = BatchCorrelationEngine()
 
     def run(self):
-        data_comy = self.band_data["SPAD"]
-        rows_name = self.band_data.keys()
+        numb_data = self.corr_engi.numeric_columns(self.band_data)
+        # 一次计算全部列与SPAD的相关系数与p值
+        corr_vect, varp_vect = self.corr_engi.pearson(numb_data.to_numpy(), numb_data["SPAD"].to_numpy())
         psca_rezu = {}
-        for name_rows in rows_name:
-            data_comx = self.band_data[name_rows]
-            psca_corr, psca_varp = self.analysis_calculation(data_comx, data_comy)
+        for name_rows, psca_corr, psca_varp in zip(numb_data.columns, corr_vect, varp_vect):
             psca_rezu[name_rows] = {
                 "psca_corr": psca_corr,
                 "psca_varp": psca_varp
@@ -38,23 +84,19 @@ class PearsonCorrelationAnalysis:
 
 
 class SpearmanRankCorrelationAnalysis:
-    def __init__(self):
-        self.base_path = Path(sys.argv[0]).resolve().parent.parent
-        self.root_logg = BandCorrelationAnalysis().root_logg
-        self.band_data = BandCorrelationAnalysis().band_data
-
-    @staticmethod
-    def analysis_calculation(data_comx, data_comy):
-        pearson_corr, pearson_p = spearmanr(data_comx, data_comy)
-        return pearson_corr, pearson_p
+    def __init__(self, data_ctxt=None):
+        data_ctxt = data_ctxt or CorrelationDatasetContext()
+        self.base_path = data_ctxt.base_path
+        self.root_logg = data_ctxt.root_logg
+        self.band_data = data_ctxt.band_data
+        self.corr_engi = BatchCorrelationEngine()
 
     def run(self):
-        data_comy = self.band_data["SPAD"]
+        numb_data = self.corr_engi.numeric_columns(self.band_data)
+        # 全部列只做一次秩变换
+        corr_vect, varp_vect = self.corr_engi.spearman(numb_data.to_numpy(), numb_data["SPAD"].to_numpy())
         srca_rezu = {}
-        rows_name = self.band_data.keys()
-        for name_rows in rows_name:
-            data_comx = self.band_data[name_rows]
-            srca_corr, srca_varp = self.analysis_calculation(data_comx, data_comy)
+        for name_rows, srca_corr, srca_varp in zip(numb_data.columns, corr_vect, varp_vect):
             srca_rezu[name_rows] = {
                 "srca_corr": srca_corr,
                 "srca_varp": srca_varp
@@ -62,15 +104,26 @@ class SpearmanRankCorrelationAnalysis:
         return srca_rezu
 
 
-class BandCorrelationAnalysis:
-    def __init__(self):
+class CorrelationDatasetContext:
+    """
+    相关性分析共享数据集上下文：日志管理器与结果数据表在一次运行中只初始化、读取一次，
+    并传递给所有分析类；可选地在CSV旁缓存Parquet副本，CSV更新后缓存自动失效。
+    Shared dataset context for the correlation analyses: the logger and the results table are set up and parsed once
+    per run and handed to every analysis class. A Parquet copy can be cached next to the CSV and is invalidated
+    whenever the CSV is newer.
+    """
+
+    def __init__(self, file_name: str = "rezu_vege_indi.csv", use_cach: bool = True):
         self.base_path = Path(sys.argv[0]).resolve().parent.parent
         # 日志文件存储路径（存放系统运行日志）
         self.logs_path = Path(self.base_path, "logs")
         self.root_logg = self._init_logger_manager()
-        self.file_name = "rezu_vege_indi.csv"
+        self.file_name = file_name
         self.data_path = Path(self.base_path, "results")
         self.data_file = Path(self.data_path, self.file_name)
+        # 缓存文件路径（与CSV同名的Parquet文件）
+        self.cach_file = self.data_file.with_suffix(".parquet")
+        self.use_cach = use_cach
         self.band_data = self._init_reflectance_csv()
 
     def _init_logger_manager(self):
@@ -113,9 +166,39 @@ class BandCorrelationAnalysis:
         return self.root_logg
 
     def _init_reflectance_csv(self):
+        """
+        读取结果数据表：缓存存在且不早于CSV时直接读取Parquet，否则解析CSV并尝试写入缓存。
+        Parquet依赖pyarrow/fastparquet，未安装时仅解析CSV。
+        """
+        if self.use_cach and self.cach_file.exists() and \
+                self.cach_file.stat().st_mtime_ns >= self.data_file.stat().st_mtime_ns:
+            try:
+                band_data = pd.read_parquet(self.cach_file)
+                self.root_logg.info(f"✅ 已从缓存载入数据集：{self.cach_file.name}")
+                return band_data
+            except (ImportError, ValueError, OSError) as e:
+                self.root_logg.warning(f"❕ 数据集缓存读取失败，改为解析CSV：{str(e)}")
         band_data = pd.read_csv(self.data_file, encoding="utf-8")
+        if self.use_cach:
+            try:
+                band_data.to_parquet(self.cach_file, index=False)
+            except (ImportError, ValueError, OSError) as e:
+                self.root_logg.info(f"数据集缓存未写入：{str(e)}")
         return band_data
 
+
+class BandCorrelationAnalysis:
+    def __init__(self, data_ctxt=None):
+        # 共享数据集上下文（日志与数据集在一次运行中只初始化、读取一次）
+        self.data_ctxt = data_ctxt or CorrelationDatasetContext()
+        self.base_path = self.data_ctxt.base_path
+        self.logs_path = self.data_ctxt.logs_path
+        self.root_logg = self.data_ctxt.root_logg
+        self.file_name = self.data_ctxt.file_name
+        self.data_path = self.data_ctxt.data_path
+        self.data_file = self.data_ctxt.data_file
+        self.band_data = self.data_ctxt.band_data
+
     @staticmethod
     def sort_by_significance(data_dict, data_keys):
         # 将字典项转换为列表，并按p值升序、相关系数绝对值降序排序
@@ -138,8 +221,8 @@ class BandCorrelationAnalysis:
         return rank_rezu
 
     def run(self):
-        clas_srca = SpearmanRankCorrelationAnalysis()
-        clas_psca = PearsonCorrelationAnalysis()
+        clas_srca = SpearmanRankCorrelationAnalysis(self.data_ctxt)
+        clas_psca = PearsonCorrelationAnalysis(self.data_ctxt)
         rezu_srca = clas_srca.run()
         rezu_psca = clas_psca.run()
         srca_rank = self.sort_by_significance(rezu_srca, "srca")
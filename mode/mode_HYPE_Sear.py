@@ -0,0 +1,311 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+超参数搜索：在模型注册表声明的搜索空间（para_spac）上运行逐次减半（Successive Halving）/ Hyperband。
+Hyperparameter search: successive halving / Hyperband over the search spaces (para_spac) declared in the model registry.
+"""
+
+from __future__ import annotations
+
+import datetime as dt
+import hashlib
+import inspect
+import json as js
+import math
+import random
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+import numpy as np
+import pandas as pd
+
+from mode_TRAN_Mode import AutoDataModelTrainerCore, DataPreprocessing
+
+
+class HyperparameterSearch:
+    """
+    基于 AutoDataModelTrainerCore._train_single_model 的超参数搜索驱动。
+    预算为训练集的抽样比例：每一轮以当前预算训练全部候选配置，按验证集R²保留前 1/redu_fact 的配置，
+    预算乘以 redu_fact 后进入下一轮，最后一轮使用全部训练数据。每个试验的结果实时追加到 JSONL 文件，
+    中断后重新运行会跳过已完成的试验；预处理后的数据划分同样缓存到磁盘，保证续跑时使用同一划分。
+    Hyperparameter search driver built on AutoDataModelTrainerCore._train_single_model.
+    The budget is the fraction of training rows: every rung trains all surviving configurations on the current
+    budget, keeps the top 1/redu_fact by validation R² and multiplies the budget by redu_fact; the last rung uses
+    the full training split. Every trial is appended to a JSONL file as soon as it finishes, so a killed search
+    skips completed trials when restarted; the preprocessed splits are cached on disk so a resumed search sees the
+    same data.
+    """
+
+    def __init__(self, trai_core: AutoDataModelTrainerCore = None, conf_numb: int = 27, redu_fact: int = 3,
+                 budg_mini: float = 1 / 9, hype_band: bool = False, jobs_numb: int = 1, seed_numb: int = 42):
+        """
+        :param trai_core: 训练器实例，未传入时新建。Trainer instance; a new one is created if omitted.
+        :param conf_numb: 逐次减半首轮的候选配置数。Number of configurations in the first rung of plain halving.
+        :param redu_fact: 每轮淘汰比例（保留 1/redu_fact）。Halving rate eta (1/eta of the configurations survive).
+        :param budg_mini: 首轮训练集抽样比例。Training fraction used in the first rung.
+        :param hype_band: 为True时运行 Hyperband（多组不同起始预算的逐次减半）。Run Hyperband brackets instead of one.
+        :param jobs_numb: 同一轮内并行的试验数（-1为全部核心）。Trials run in parallel within a rung (-1: all cores).
+        :param seed_numb: 配置采样与训练集抽样的随机种子。Seed for configuration sampling and row subsampling.
+        """
+        self.trai_core = trai_core or AutoDataModelTrainerCore()
+        self.root_logg = self.trai_core.root_logg
+        self.rezu_path = self.trai_core.rezu_path
+        self.conf_numb = conf_numb
+        self.redu_fact = redu_fact
+        self.budg_mini = budg_mini
+        self.hype_band = hype_band
+        self.jobs_numb = jobs_numb
+        self.seed_numb = seed_numb
+        # 抽样后训练集的最少行数
+        self.samp_mini = 10
+
+    @staticmethod
+    def sample_config(para_spac: Dict[str, Any], rand_objt: random.Random) -> Dict[str, Any]:
+        """
+        从搜索空间中采样一组参数。列表为离散候选值；字典为数值区间 {"type": "int"/"float", "low", "high", "log"}。
+        Sample one configuration. A list is a set of choices; a dict is a numeric range
+        {"type": "int"/"float", "low", "high", "log"}.
+        :param para_spac: Search space from the registry's para_spac.
+        :param rand_objt: Seeded random generator.
+        :return: Parameter dictionary.
+        """
+        para_conf = {}
+        for para_name, spac_item in para_spac.items():
+            if isinstance(spac_item, list):
+                para_conf[para_name] = rand_objt.choice(spac_item)
+                continue
+            lowr_bond, uppr_bond = spac_item["low"], spac_item["high"]
+            if spac_item.get("log"):
+                para_valu = math.exp(rand_objt.uniform(math.log(lowr_bond), math.log(uppr_bond)))
+            else:
+                para_valu = rand_objt.uniform(lowr_bond, uppr_bond)
+            if spac_item.get("type") == "int":
+                para_valu = int(min(max(round(para_valu), lowr_bond), uppr_bond))
+            para_conf[para_name] = para_valu
+        return para_conf
+
+    def _source_signature(self, prep_conf: Dict[str, Any]) -> str:
+        """
+        数据源签名：反射率CSV与公式、波段配置文件的大小和修改时间（纳秒），以及数据划分种子与预处理参数。
+        Signature of the data source: size and mtime_ns of the reflectance CSV and the formula/band configs, plus the
+        split seed and the preprocessing options.
+        """
+        runt_ctxt = self.trai_core.runt_ctxt
+        # 与 DataPreprocessing 读取的文件一致
+        list_srce = [
+            Path(runt_ctxt.rezu_path, "rezu_spad_refl.csv"),
+            Path(runt_ctxt.sets_path, "sets_data_func.json"),
+            Path(runt_ctxt.sets_path, "sets_band_wave.json")
+            ]
+        spli_seed = prep_conf.get(
+                "seed_numb", inspect.signature(DataPreprocessing).parameters["seed_numb"].default
+                )
+        dict_sign = {"prep_conf": prep_conf, "spli_seed": spli_seed}
+        for path_srce in list_srce:
+            stat_srce = path_srce.stat() if path_srce.exists() else None
+            dict_sign[path_srce.name] = [stat_srce.st_size, stat_srce.st_mtime_ns] if stat_srce else None
+        return hashlib.sha1(js.dumps(dict_sign, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+
+    def _trial_signature(self, srce_sign: str) -> str:
+        """试验记录签名：数据源签名加上抽样种子与逐次减半设置（任一变化时已完成的试验不可复用）"""
+        dict_sign = {
+            "srce_sign": srce_sign, "seed_numb": self.seed_numb, "redu_fact": self.redu_fact,
+            "budg_mini": self.budg_mini, "hype_band": self.hype_band
+            }
+        return hashlib.sha1(js.dumps(dict_sign, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+    def _init_splits_cache(self, prep_conf: Dict[str, Any], srce_sign: str) -> Dict[str, Any]:
+        """
+        读取或生成预处理后的数据划分；按预处理参数缓存到 results 目录，续跑时复用同一划分。
+        缓存中记录数据源签名，反射率CSV、配置文件或划分种子变化后缓存作废并重新生成。
+        Load or build the preprocessed splits, cached under results/ per preprocessing options so that a resumed
+        search trains on the same split. The cache stores the source signature and is rebuilt when the reflectance
+        CSV, the config files or the split seed change.
+        """
+        from joblib import dump, load
+
+        name_conf = "_".join(f"{name}-{valu}" for name, valu in sorted(prep_conf.items())) or "default"
+        path_cach = Path(self.rezu_path, f"Hpo_Spli_{name_conf}.joblib")
+        if path_cach.exists():
+            try:
+                cach_data = load(path_cach)
+            except Exception as e:
+                cach_data = None
+                self.root_logg.warning(f"❕ 数据划分缓存无法读取，重新生成：{path_cach.name}（{str(e)}）")
+            if isinstance(cach_data, dict) and cach_data.get("srce_sign") == srce_sign:
+                self.root_logg.info(f"✅ 已从缓存载入数据划分：{path_cach.name}")
+                return cach_data["spli_data"]
+            if cach_data is not None:
+                self.root_logg.warning(f"❕ 数据源或划分设置已变化，数据划分缓存作废：{path_cach.name}")
+        spli_data = DataPreprocessing(self.trai_core.runt_ctxt, **prep_conf).run()
+        dump({"srce_sign": srce_sign, "spli_data": spli_data}, path_cach)
+        return spli_data
+
+    def _subsample_splits(self, dict_spli: Dict[str, Any], rows_perm: np.ndarray, budg_rati: float) -> Dict[str, Any]:
+        """按预算比例抽取训练集前若干行（同一排列，预算越大所含行越多），验证集与测试集保持不变"""
+        x_train, y_train = dict_spli["tran_sets"]
+        samp_numb = min(len(rows_perm), max(self.samp_mini, math.ceil(budg_rati * len(rows_perm))))
+        rows_samp = np.sort(rows_perm[:samp_numb])
+        return {**dict_spli, "tran_sets": (x_train[rows_samp], y_train[rows_samp])}
+
+    @staticmethod
+    def _load_trials(path_tria: Path, tria_sign: str = None) -> tuple:
+        """
+        读取已完成的试验记录（忽略中断时写了一半的末行），返回 (签名一致的记录, 签名不一致的记录数)。
+        Read the finished trials (a half-written last line is ignored) and return (records whose signature matches,
+        number of stale records).
+        """
+        dict_tria, stal_numb = {}, 0
+        if not path_tria.exists():
+            return dict_tria, stal_numb
+        with open(path_tria, "r", encoding="utf-8") as file_tria:
+            for line_text in file_tria:
+                try:
+                    tria_rezu = js.loads(line_text)
+                except ValueError:
+                    continue
+                if tria_rezu.get("tria_sign") != tria_sign:
+                    stal_numb += 1
+                    continue
+                dict_tria[tria_rezu["tria_keys"]] = tria_rezu
+        return dict_tria, stal_numb
+
+    def _run_trial(self, tria_info: Dict[str, Any], dict_spli: Dict[str, Any], thre_numb: int = None) -> Dict[str, Any]:
+        """以单次尝试、不保存检查点的方式训练一个配置，返回试验记录"""
+        time_star = time.perf_counter()
+        dict_resu = self.trai_core._train_single_model(
+                tria_info["mode_name"], dict_spli, thre_numb, para_over=tria_info["para_conf"], save_ckpt=False,
+                retr_maxm=1
+                )
+        vali_scor = float(dict_resu["vali_r2"])
+        return {
+            **tria_info,
+            "samp_numb": len(dict_spli["tran_sets"][1]),
+            "vali_r2": vali_scor if np.isfinite(vali_scor) else None,
+            "test_r2": float(dict_resu["best_r2"]) if np.isfinite(dict_resu["best_r2"]) else None,
+            "time_cost": time.perf_counter() - time_star
+            }
+
+    def _bracket_plan(self) -> List[tuple]:
+        """返回各组逐次减半的 (组序号, 首轮配置数, 首轮预算, 轮数)"""
+        rond_maxm = max(0, int(round(math.log(1 / self.budg_mini, self.redu_fact))))
+        if not self.hype_band:
+            return [(0, self.conf_numb, self.budg_mini, rond_maxm + 1)]
+        list_plan = []
+        for brac_indx, vari_rond in enumerate(range(rond_maxm, -1, -1)):
+            conf_numb = math.ceil((rond_maxm + 1) / (vari_rond + 1) * self.redu_fact**vari_rond)
+            list_plan.append((brac_indx, conf_numb, self.redu_fact**-vari_rond, vari_rond + 1))
+        return list_plan
+
+    def search(self, mode_name: str, func_name: str, dict_spli: Dict[str, Any], path_tria: Path,
+               tria_sign: str = None) -> Dict[str, Any]:
+        """
+        对一个 (特征集, 模型) 组合运行逐次减半 / Hyperband，返回全部训练数据下验证集R²最高的试验记录。
+        Run successive halving / Hyperband for one (feature set, model) pair and return the trial with the best
+        validation R² at full budget.
+        :param mode_name: Registered model name with a para_spac entry.
+        :param func_name: Feature set name (key of DataPreprocessing.run()).
+        :param dict_spli: Preprocessed splits of this feature set.
+        :param path_tria: JSONL file the trials are streamed to.
+        :param tria_sign: Signature of the data source and search settings; trials recorded under another signature
+                          are discarded.
+        :return: Best trial record, or None if every trial failed.
+        """
+        from joblib import Parallel, delayed
+
+        para_spac = self.trai_core.spac_mode[mode_name]
+        dict_tria, stal_numb = self._load_trials(path_tria, tria_sign)
+        if stal_numb:
+            self.root_logg.warning(
+                    f"❕ {path_tria.name} 中 {stal_numb} 条试验记录的数据源或搜索设置已变化，已作废并重新搜索"
+                    )
+        rows_perm = np.random.default_rng(self.seed_numb).permutation(len(dict_spli["tran_sets"][1]))
+        thre_numb = 1 if self.jobs_numb != 1 else None
+        list_full = []
+        # 存在作废记录时重写试验文件，只保留签名一致的记录
+        with open(path_tria, "w" if stal_numb else "a", encoding="utf-8") as file_tria:
+            for tria_rezu in (dict_tria.values() if stal_numb else []):
+                file_tria.write(js.dumps(tria_rezu, ensure_ascii=False) + "\n")
+            for brac_indx, conf_numb, budg_rati, rond_numb in self._bracket_plan():
+                # 同一组的候选配置由固定种子生成，续跑时与中断前一致
+                rand_objt = random.Random(f"{self.seed_numb}-{mode_name}-{func_name}-{brac_indx}")
+                list_conf = [(conf_indx, self.sample_config(para_spac, rand_objt)) for conf_indx in range(conf_numb)]
+                for rond_indx in range(rond_numb):
+                    rond_budg = min(1.0, budg_rati * self.redu_fact**rond_indx)
+                    rond_spli = self._subsample_splits(dict_spli, rows_perm, rond_budg)
+                    list_rond, list_pend = [], []
+                    for conf_indx, para_conf in list_conf:
+                        tria_keys = f"{func_name}|{mode_name}|b{brac_indx}|r{rond_indx}|c{conf_indx}"
+                        tria_rezu = dict_tria.get(tria_keys)
+                        if tria_rezu and tria_rezu["para_conf"] == para_conf:
+                            list_rond.append(tria_rezu)
+                            continue
+                        list_pend.append({
+                            "tria_keys": tria_keys, "func_name": func_name, "mode_name": mode_name,
+                            "brac_indx": brac_indx, "rond_indx": rond_indx, "conf_indx": conf_indx,
+                            "budg_rati": rond_budg, "para_conf": para_conf, "tria_sign": tria_sign
+                            })
+                    self.root_logg.info(
+                            f"▶ 超参数搜索 {func_name} × {mode_name} | 组 {brac_indx} 轮 {rond_indx} | "
+                            f"配置 {len(list_conf)} 个（续跑跳过 {len(list_rond)} 个）| 训练集比例 {rond_budg:.3f}"
+                            )
+                    # 试验完成一个写入一个，中断时最多丢失正在运行的试验
+                    for tria_rezu in Parallel(n_jobs=self.jobs_numb, backend="loky", return_as="generator")(
+                            delayed(self._run_trial)(tria_info, rond_spli, thre_numb) for tria_info in list_pend
+                            ):
+                        file_tria.write(js.dumps(tria_rezu, ensure_ascii=False) + "\n")
+                        file_tria.flush()
+                        list_rond.append(tria_rezu)
+                    list_rond.sort(key=lambda item: -np.inf if item["vali_r2"] is None else item["vali_r2"],
+                                   reverse=True)
+                    if rond_indx == rond_numb - 1:
+                        list_full.extend(list_rond)
+                        break
+                    # 保留验证集R²最高的 1/redu_fact 个配置
+                    keep_numb = max(1, len(list_rond) // self.redu_fact)
+                    list_conf = [(item["conf_indx"], item["para_conf"]) for item in list_rond[:keep_numb]]
+        list_full = [item for item in list_full if item["vali_r2"] is not None]
+        return max(list_full, key=lambda item: item["vali_r2"]) if list_full else None
+
+    def run(self, func_list: List[str] = None, **prep_conf) -> pd.DataFrame:
+        """
+        对注册表中声明了 para_spac 的全部模型与指定特征集运行搜索，结果汇总为一张表写入 results 目录。
+        Search every registry model that declares a para_spac on the given feature sets and write the best
+        configuration of each pair to one table under results/.
+        :param func_list: Feature set names to search; defaults to all feature sets produced by preprocessing.
+        :param prep_conf: Feature options forwarded to DataPreprocessing (feat_mode, band_topk, redu_mode, comp_numb).
+        :return: pandas.DataFrame with the best trial per (feature set, model).
+        """
+        if not self.trai_core.spac_mode:
+            self.root_logg.warning("❕ 注册表中没有声明 para_spac 的模型，跳过超参数搜索")
+            return pd.DataFrame()
+        srce_sign = self._source_signature(prep_conf)
+        spli_data = self._init_splits_cache(prep_conf, srce_sign)
+        tria_sign = self._trial_signature(srce_sign)
+        func_list = func_list or [name for name in spli_data.keys()]
+        time_star = time.perf_counter()
+        list_best = []
+        for func_name in func_list:
+            for mode_name in self.trai_core.spac_mode:
+                path_tria = Path(self.rezu_path, f"Hpo_Tria_{func_name}_{mode_name}.jsonl")
+                best_tria = self.search(mode_name, func_name, spli_data[func_name], path_tria, tria_sign)
+                if best_tria is None:
+                    self.root_logg.error(f"❌ {func_name} × {mode_name} 全部试验失败")
+                    continue
+                self.root_logg.info(
+                        f"✅ {func_name} × {mode_name} 最佳配置：{best_tria['para_conf']} | "
+                        f"验证集R²：{best_tria['vali_r2']:.4f} | 测试集R²：{best_tria['test_r2']:.4f}"
+                        )
+                list_best.append({**best_tria, "para_conf": js.dumps(best_tria["para_conf"], ensure_ascii=False)})
+        rezu_tabl = pd.DataFrame(list_best)
+        stri_time = dt.datetime.now().strftime("%Y%m%d_%H%M%S")
+        path_tabl = Path(self.rezu_path, f"Hpo_Best_{stri_time}.csv")
+        rezu_tabl.to_csv(path_tabl, index=False, encoding="utf-8")
+        self.root_logg.info(f"▷ 超参数搜索完成：耗时 {time.perf_counter() - time_star:.2f}秒 | 结果表：{path_tabl}")
+        return rezu_tabl
+
+
+if __name__ == "__main__":
+    HyperparameterSearch().run()
@@ -0,0 +1,380 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+检查点批量预测服务：载入 ckpt/ 中保存的模型及其 .json 元数据，按训练时的特征构建方式对反射率CSV或.dat影像批量预测SPAD。
+Batch prediction service: loads checkpoints saved under ckpt/ together with their .json sidecar and predicts SPAD for
+reflectance CSVs or .dat cubes, building features exactly as during training.
+"""
+
+from __future__ import annotations
+
+import json as js
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import islice
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+import numpy as np
+import pandas as pd
+
+from mode_TRAN_Mode import RuntimeContext, VegetationIndexCompiler
+
+
+class LoadedCheckpoint:
+    """
+    已载入的检查点：模型对象、元数据、可选的降维对象，以及（指数特征时）编译好的植被指数表达式。
+    A loaded checkpoint: estimator, sidecar metadata, optional fitted reduction and, for index features, the
+    compiled vegetation index expression.
+    """
+
+    def __init__(self, path_ckpt: Path, mode_objt, dict_meta: Dict[str, Any], redu_objt=None):
+        self.path_ckpt = path_ckpt
+        self.mode_objt = mode_objt
+        self.dict_meta = dict_meta
+        self.feat_meta = dict_meta.get("feat_meta", {})
+        self.redu_objt = redu_objt
+        self.indx_expr = None
+        if self.feat_meta.get("feat_mode") == "index":
+            wave_band = self.feat_meta["wave_band"]
+            # 使用训练时解析得到的波段，预测时不再重新匹配波长
+            self.indx_expr = VegetationIndexCompiler(lambda targ_wave: wave_band[f"{targ_wave:g}"]).compile(
+                    self.feat_meta["func_stri"]
+                    )
+
+    @property
+    def band_list(self) -> List[str]:
+        """构建特征所需的全部波段名称"""
+        if self.indx_expr is not None:
+            return list(self.indx_expr.band_list)
+        return list(self.feat_meta.get("band_list", []))
+
+    def build_features(self, band_getr: Callable[[str], np.ndarray]) -> np.ndarray:
+        """
+        按训练时的方式构建特征矩阵：指数特征为 [指数值, 1]，光谱特征为所选波段列，降维对象存在时再做变换。
+        Build the feature matrix as in training: [index, 1] for index features, the selected band columns for
+        spectral features, followed by the fitted reduction if any.
+        :param band_getr: Function mapping a band name to its column vector.
+        :return: Contiguous float32 feature matrix.
+        """
+        if self.indx_expr is not None:
+            indx_vect = self.indx_expr(band_getr)
+            feat_matx = np.column_stack([indx_vect, np.ones_like(indx_vect)])
+        else:
+            feat_matx = np.column_stack([np.asarray(band_getr(band_name), dtype=np.float64)
+                                         for band_name in self.band_list])
+        feat_matx = np.ascontiguousarray(feat_matx, dtype=np.float32)
+        if self.redu_objt is not None:
+            feat_matx = np.ascontiguousarray(self.redu_objt.transform(feat_matx), dtype=np.float32)
+        return feat_matx
+
+    def predict(self, band_getr: Callable[[str], np.ndarray]) -> np.ndarray:
+        """构建特征并预测；任一特征为NaN的样本预测值为NaN"""
+        feat_matx = self.build_features(band_getr)
+        pred_vect = np.full(feat_matx.shape[0], np.nan)
+        vali_rows = np.isfinite(feat_matx).all(axis=1)
+        if vali_rows.any():
+            pred_vect[vali_rows] = np.ravel(self.mode_objt.predict(feat_matx[vali_rows]))
+        return pred_vect
+
+
+class CheckpointPredictionService:
+    """
+    SPAD批量预测入口：检查点以 joblib.load(mmap_mode="r") 载入并按路径缓存在LRU中，
+    输入可以是反射率CSV（逐块读取所需波段列）或 .dat 影像 + 坐标点CSV（只读取所需波段在坐标点外接矩形内的窗口）。
+    Entry point for batch SPAD prediction. Checkpoints are loaded with joblib.load(mmap_mode="r") and kept in an LRU
+    cache keyed by path. Inputs are reflectance CSVs (read in chunks, only the needed band columns) or a .dat cube
+    plus a points CSV (only the needed bands are read, within the bounding window of the points).
+    """
+
+    def __init__(self, runt_ctxt: RuntimeContext = None, cach_size: int = 8, batc_size: int = 65536):
+        """
+        :param runt_ctxt: 共享运行时上下文，未传入时新建。Shared runtime context; a new one is created if omitted.
+        :param cach_size: LRU中保留的检查点数量。Number of checkpoints kept in the LRU cache.
+        :param batc_size: 每批预测的样本数（CSV按此行数分块读取）。Samples per prediction batch / CSV chunk.
+        """
+        self.runt_ctxt = runt_ctxt or RuntimeContext()
+        self.ckpt_path = self.runt_ctxt.ckpt_path
+        self.rezu_path = self.runt_ctxt.rezu_path
+        self.root_logg = self.runt_ctxt.root_logg
+        self.batc_size = batc_size
+        # 按检查点路径缓存已载入的模型
+        self._load_cached = lru_cache(maxsize=cach_size)(self._load_checkpoint)
+
+    def _load_checkpoint(self, path_ckpt: str) -> LoadedCheckpoint:
+        """
+        载入检查点及其元数据（模型中的大数组以只读内存映射方式打开）。
+        :raises FileNotFoundError: 检查点或 .json 元数据不存在时抛出。
+        """
+        from joblib import load
+
+        path_ckpt = Path(path_ckpt)
+        path_meta = path_ckpt.with_suffix(".json")
+        if not path_ckpt.exists() or not path_meta.exists():
+            self.root_logg.error(f"❌ 检查点或元数据缺失：{path_ckpt.name}")
+            raise FileNotFoundError(f"❌ 检查点或元数据缺失：{path_ckpt}")
+        with open(path_meta, "r", encoding="utf-8") as file_meta:
+            dict_meta = js.load(file_meta)
+        mode_objt = load(path_ckpt, mmap_mode="r")
+        redu_objt = load(Path(path_ckpt.parent, dict_meta["redu_file"])) if dict_meta.get("redu_file") else None
+        self.root_logg.info(f"✅ 检查点已载入：{path_ckpt.name}（{dict_meta.get('mode_name')}）")
+        return LoadedCheckpoint(path_ckpt, mode_objt, dict_meta, redu_objt)
+
+    def load_checkpoint(self, path_ckpt) -> LoadedCheckpoint:
+        """按路径取得已载入的检查点（命中LRU时不再读盘）"""
+        return self._load_cached(str(Path(path_ckpt).resolve()))
+
+    def latest_checkpoint(self, mode_name: str = None, feat_name: str = None) -> Path:
+        """
+        返回某模型（可选限定特征集名称，即 DataPreprocessing.run() 的键，如 full_spectrum、ranked_top20_pca5）
+        最新的检查点路径；mode_name 为None时不限模型。特征集名称须完全匹配：full_spectrum 不会命中 full_spectrum_pca5 的检查点。
+        :raises FileNotFoundError: 没有匹配的检查点时抛出。
+        """
+        patn_ckpt = f"{mode_name or '*'}_{feat_name}_*.joblib" if feat_name else f"{mode_name or '*'}_*.joblib"
+        # 文件名为 <模型>_<特征集>_<YYYYmmdd_HHMMSS>.joblib
+        patn_name = re.compile(
+                rf"{re.escape(mode_name) if mode_name else '.+'}_{re.escape(feat_name) if feat_name else '.+'}"
+                rf"_\d{{8}}_\d{{6}}\.joblib"
+                )
+        list_ckpt = [path for path in Path(self.ckpt_path).glob(patn_ckpt) if patn_name.fullmatch(path.name)]
+        if not list_ckpt:
+            raise FileNotFoundError(f"❌ 未找到检查点：{patn_ckpt}")
+        return max(list_ckpt, key=lambda path: path.stat().st_mtime_ns)
+
+    def predict_csv(self, path_ckpt, csv_path, output_csv=None) -> pd.DataFrame:
+        """
+        对反射率CSV（列名 Band_1…）逐块预测SPAD，保留 ID/X/Y 列；给定 output_csv 时写出结果。
+        Predict SPAD for a reflectance CSV (columns Band_1, ...) chunk by chunk, keeping the ID/X/Y columns; the
+        result is written to output_csv when given.
+        """
+        chkp_objt = self.load_checkpoint(path_ckpt)
+        colm_need = set(chkp_objt.band_list) | {"ID", "X", "Y"}
+        time_star = time.perf_counter()
+        list_rezu = []
+        for data_chnk in pd.read_csv(csv_path, usecols=lambda name: name in colm_need, chunksize=self.batc_size):
+            rezu_chnk = data_chnk[[name for name in ("ID", "X", "Y") if name in data_chnk]].copy()
+            rezu_chnk["SPAD_pred"] = chkp_objt.predict(
+                    lambda band_name: data_chnk[band_name].to_numpy(dtype=np.float64)
+                    )
+            list_rezu.append(rezu_chnk)
+        rezu_tabl = pd.concat(list_rezu, ignore_index=True) if list_rezu else pd.DataFrame(columns=["SPAD_pred"])
+        self._log_throughput(Path(csv_path).name, len(rezu_tabl), time.perf_counter() - time_star)
+        if output_csv:
+            rezu_tabl.to_csv(output_csv, index=False, encoding="utf-8")
+        return rezu_tabl
+
+    def predict_dat(self, path_ckpt, dat_path, points_csv, output_csv=None) -> pd.DataFrame:
+        """
+        对 .dat 影像在坐标点（image_tag 生成的 ID/X/Y，1起始）处预测SPAD。只读取所需波段，
+        且只读取包含全部坐标点的最小窗口。
+        Predict SPAD at the points (ID/X/Y from image_tag, 1-based) of a .dat cube. Only the needed bands are read,
+        and only within the smallest window that contains every point.
+        """
+        import rasterio
+        from rasterio.windows import Window
+
+        chkp_objt = self.load_checkpoint(path_ckpt)
+        coor_fram = pd.read_csv(points_csv)
+        time_star = time.perf_counter()
+        rows_indx = coor_fram["Y"].to_numpy(dtype=np.intp) - 1
+        cols_indx = coor_fram["X"].to_numpy(dtype=np.intp) - 1
+        band_list = chkp_objt.band_list
+        with rasterio.open(dat_path) as src:
+            insd_mask = (rows_indx >= 0) & (rows_indx < src.height) & (cols_indx >= 0) & (cols_indx < src.width)
+            if not insd_mask.all():
+                self.root_logg.warning(f"❕ {Path(dat_path).name} 有 {int((~insd_mask).sum())} 个坐标点超出影像范围")
+            band_valu = np.full((len(band_list), len(coor_fram)), np.nan)
+            if insd_mask.any():
+                rows_mini, cols_mini = rows_indx[insd_mask].min(), cols_indx[insd_mask].min()
+                wind_objt = Window(
+                        int(cols_mini), int(rows_mini), int(cols_indx[insd_mask].max() - cols_mini + 1),
+                        int(rows_indx[insd_mask].max() - rows_mini + 1)
+                        )
+                band_wind = src.read([int(band_name.split("_")[1]) for band_name in band_list], window=wind_objt)
+                band_valu[:, insd_mask] = band_wind[:, rows_indx[insd_mask] - rows_mini, cols_indx[insd_mask] - cols_mini]
+        band_rows = {band_name: numb for numb, band_name in enumerate(band_list)}
+        rezu_tabl = coor_fram[["ID", "X", "Y"]].copy()
+        rezu_tabl["SPAD_pred"] = chkp_objt.predict(lambda band_name: band_valu[band_rows[band_name]])
+        self._log_throughput(Path(dat_path).name, len(rezu_tabl), time.perf_counter() - time_star)
+        if output_csv:
+            rezu_tabl.to_csv(output_csv, index=False, encoding="utf-8")
+        return rezu_tabl
+
+    def _log_throughput(self, name_inpt: str, samp_numb: int, time_cost: float) -> None:
+        """记录单个输入的样本数与吞吐量"""
+        self.root_logg.info(
+                f"▷ 预测完成：{name_inpt} | 样本数：{samp_numb} | 耗时：{time_cost:.3f}秒 | "
+                f"吞吐量：{samp_numb / time_cost if time_cost > 0 else 0.0:.0f} 样本/秒"
+                )
+
+    def default_inputs(self) -> List:
+        """
+        默认预测输入：results/<id>/ 下 obtain_reflectance 写出的逐点反射率CSV；尚无反射率CSV的图像ID，
+        若 meta_data/<id>/results/REFLECTANCE_<id>.dat 与坐标点CSV均存在，则以 (.dat, 坐标点CSV) 二元组预测。
+        Default inputs: the per-point reflectance CSVs written by obtain_reflectance under results/<id>/; image IDs
+        without one are predicted from (REFLECTANCE_<id>.dat, points CSV) when both exist.
+        """
+        list_inpt = []
+        for path_dirs in sorted(path for path in Path(self.rezu_path).iterdir() if path.is_dir()):
+            image_id = path_dirs.name
+            path_csvs = Path(path_dirs, f"reflectance_{image_id}.csv")
+            path_dats = Path(self.runt_ctxt.base_path, "meta_data", image_id, "results", f"REFLECTANCE_{image_id}.dat")
+            path_pnts = Path(path_dirs, f"{image_id}_points.csv")
+            if path_csvs.exists():
+                list_inpt.append(path_csvs)
+            elif path_dats.exists() and path_pnts.exists():
+                list_inpt.append((path_dats, path_pnts))
+        return list_inpt
+
+    def run(self, path_ckpt=None, list_inpt: List = None, output_dir=None) -> Dict[str, pd.DataFrame]:
+        """
+        批量预测多个输入：元素为CSV路径，或 (.dat路径, 坐标点CSV路径) 二元组；结果写入 output_dir（默认 results/）。
+        未指定检查点时使用最新的检查点，未指定输入时使用 default_inputs()。
+        Predict several inputs. Each item is a CSV path or a (.dat path, points CSV path) pair; results are written to
+        output_dir (results/ by default). Without path_ckpt the newest checkpoint is used, without list_inpt the
+        inputs found by default_inputs().
+        :return: {input name: prediction table}
+        """
+        path_ckpt = path_ckpt or self.latest_checkpoint()
+        list_inpt = self.default_inputs() if list_inpt is None else list_inpt
+        if not list_inpt:
+            self.root_logg.warning("❕ 未找到待预测的反射率CSV或 .dat 影像")
+        output_dir = Path(output_dir or self.rezu_path)
+        dict_rezu = {}
+        for item_inpt in list_inpt:
+            if isinstance(item_inpt, (tuple, list)):
+                dat_path, points_csv = item_inpt
+                name_inpt = Path(dat_path).stem
+                dict_rezu[name_inpt] = self.predict_dat(
+                        path_ckpt, dat_path, points_csv, Path(output_dir, f"Pred_{name_inpt}.csv")
+                        )
+            else:
+                name_inpt = Path(item_inpt).stem
+                dict_rezu[name_inpt] = self.predict_csv(path_ckpt, item_inpt, Path(output_dir, f"Pred_{name_inpt}.csv"))
+        return dict_rezu
+
+
+class SpadRasterMapper:
+    """
+    逐像元SPAD制图：按瓦片流式读取整幅 REFLECTANCE_<id>.dat，只读取检查点特征所需的波段，
+    以检查点保存的公式（来自 sets_data_func.json）计算植被指数并预测，结果写为分块GeoTIFF（或ENVI）。
+    多个线程并行处理瓦片（每个线程独立打开数据集），同时在途的瓦片数有上限，内存占用与影像大小无关。
+    Per-pixel SPAD mapping. The whole REFLECTANCE_<id>.dat scene is streamed tile by tile, reading only the bands
+    the checkpoint's features need; the vegetation index is computed from the formula stored with the checkpoint
+    (taken from sets_data_func.json) and the model is applied. Output is a tiled GeoTIFF (or ENVI). Tiles are
+    processed by a thread pool (each thread opens its own dataset handle) with a bounded number of tiles in flight,
+    so memory does not grow with the scene size.
+    """
+
+    def __init__(self, pred_serv: CheckpointPredictionService = None, tile_size: int = 256, work_numb: int = 2,
+                 driv_name: str = "GTiff"):
+        """
+        :param pred_serv: 检查点预测服务（共享其LRU缓存），未传入时新建。Prediction service whose checkpoint cache is reused.
+        :param tile_size: 瓦片边长（像元，GeoTIFF分块大小，需为16的倍数）。Tile edge in pixels (GeoTIFF block size,
+                          a multiple of 16).
+        :param work_numb: 并行处理瓦片的线程数。Number of tile worker threads.
+        :param driv_name: 输出格式 "GTiff" 或 "ENVI"。Output driver, "GTiff" or "ENVI".
+        """
+        self.pred_serv = pred_serv or CheckpointPredictionService()
+        self.root_logg = self.pred_serv.root_logg
+        self.rezu_path = self.pred_serv.rezu_path
+        self.tile_size = tile_size
+        self.work_numb = work_numb
+        self.driv_name = driv_name
+
+    def _tile_windows(self, wind_widt: int, wind_heig: int):
+        """按 tile_size 网格生成覆盖整幅影像的窗口"""
+        from rasterio.windows import Window
+
+        for rows_star in range(0, wind_heig, self.tile_size):
+            for cols_star in range(0, wind_widt, self.tile_size):
+                yield Window(
+                        cols_star, rows_star, min(self.tile_size, wind_widt - cols_star),
+                        min(self.tile_size, wind_heig - rows_star)
+                        )
+
+    def _predict_tile(self, chkp_objt: LoadedCheckpoint, dat_path, band_indx: List[int], wind_objt,
+                      thre_data: threading.local, list_hand: list) -> np.ndarray:
+        """读取一个瓦片的所需波段并预测，返回 (高, 宽) 的float32 SPAD数组；每个线程复用自己的数据集句柄"""
+        import rasterio
+
+        if getattr(thre_data, "src", None) is None:
+            thre_data.src = rasterio.open(dat_path)
+            list_hand.append(thre_data.src)
+        band_tile = thre_data.src.read(band_indx, window=wind_objt, masked=True)
+        band_tile = band_tile.astype(np.float64).filled(np.nan)
+        band_rows = {band_name: numb for numb, band_name in enumerate(chkp_objt.band_list)}
+        pred_vect = chkp_objt.predict(lambda band_name: band_tile[band_rows[band_name]].ravel())
+        return pred_vect.reshape(band_tile.shape[1:]).astype(np.float32)
+
+    def predict_raster(self, path_ckpt, dat_path, output_path=None) -> Path:
+        """
+        生成一幅影像的逐像元SPAD图。
+        Produce the per-pixel SPAD map of one scene.
+        :param path_ckpt: Checkpoint path.
+        :param dat_path: Reflectance cube (.dat with ENVI header).
+        :param output_path: Output raster; defaults to results/<image id>/SPAD_MAP_<image id>.tif (.dat for ENVI).
+        :return: Path of the written raster.
+        """
+        import rasterio
+
+        chkp_objt = self.pred_serv.load_checkpoint(path_ckpt)
+        band_indx = [int(band_name.split("_")[1]) for band_name in chkp_objt.band_list]
+        image_id = Path(dat_path).stem.replace("REFLECTANCE_", "")
+        if output_path is None:
+            name_suff = ".tif" if self.driv_name == "GTiff" else ".dat"
+            output_path = Path(self.rezu_path, image_id, f"SPAD_MAP_{image_id}{name_suff}")
+        output_path = Path(output_path)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        with rasterio.open(dat_path) as src:
+            dst_prof = {
+                "driver": self.driv_name, "width": src.width, "height": src.height, "count": 1,
+                "dtype": "float32", "nodata": np.nan, "crs": src.crs, "transform": src.transform
+                }
+        if self.driv_name == "GTiff":
+            dst_prof.update(tiled=True, blockxsize=self.tile_size, blockysize=self.tile_size, compress="deflate")
+        time_star = time.perf_counter()
+        thre_data, list_hand = threading.local(), []
+        tile_numb = 0
+        try:
+            with rasterio.open(output_path, "w", **dst_prof) as dst, \
+                    ThreadPoolExecutor(max_workers=self.work_numb) as pool:
+                # 在途瓦片数不超过 2 × work_numb，主线程按提交顺序依次写出
+                pending = deque()
+                wind_iter = self._tile_windows(dst_prof["width"], dst_prof["height"])
+                for wind_objt in islice(wind_iter, 2 * self.work_numb):
+                    pending.append((wind_objt, pool.submit(
+                            self._predict_tile, chkp_objt, dat_path, band_indx, wind_objt, thre_data, list_hand
+                            )))
+                while pending:
+                    wind_objt, futu_objt = pending.popleft()
+                    for next_wind in islice(wind_iter, 1):
+                        pending.append((next_wind, pool.submit(
+                                self._predict_tile, chkp_objt, dat_path, band_indx, next_wind, thre_data, list_hand
+                                )))
+                    dst.write(futu_objt.result(), 1, window=wind_objt)
+                    tile_numb += 1
+        finally:
+            for src_hand in list_hand:
+                src_hand.close()
+        time_cost = time.perf_counter() - time_star
+        pixl_numb = dst_prof["width"] * dst_prof["height"]
+        self.root_logg.info(
+                f"▷ SPAD图完成：{image_id} | {dst_prof['width']}×{dst_prof['height']} 像元，{tile_numb} 个瓦片，"
+                f"读取 {len(band_indx)} 个波段 | 耗时：{time_cost:.2f}秒 | "
+                f"{pixl_numb / time_cost if time_cost > 0 else 0.0:.0f} 像元/秒 | 输出：{output_path}"
+                )
+        return output_path
+
+    def run(self, path_ckpt, list_dat: List) -> List[Path]:
+        """对多幅影像依次生成SPAD图（单幅内部按瓦片并行）"""
+        return [self.predict_raster(path_ckpt, dat_path) for dat_path in list_dat]
+
+
+if __name__ == "__main__":
+    CheckpointPredictionService().run()
@@ -5,42 +5,68 @@
 
 """
 
-import csv
+from __future__ import annotations
+
+import ast
 import datetime as dt
+import importlib
 import json as js
 import logging as log
 import random
 import re
+import shutil
 import sys
+import tempfile
+import time
+from functools import lru_cache
 from pathlib import Path
-from typing import Any, Dict
-from scipy.stats import ks_2samp
+from typing import TYPE_CHECKING, Any, Dict
 
 import numpy as np
-from catboost import CatBoostRegressor
-from joblib import dump
-from lightgbm import LGBMRegressor
-from sklearn.base import BaseEstimator
-from sklearn.cross_decomposition import PLSRegression
-from sklearn.gaussian_process import GaussianProcessRegressor
-from sklearn.gaussian_process.kernels import RBF, WhiteKernel
-from sklearn.linear_model import ElasticNet, Lasso, Ridge
-from sklearn.metrics import r2_score
-from sklearn.neighbors import KNeighborsRegressor
-from sklearn.neural_network import MLPRegressor
-from sklearn.svm import SVR
-from xgboost import XGBRegressor
+import pandas as pd
 
+from mode_EVAL_Metr import LIST_METR_NAME, BatchMetricEvaluator, write_results_table
 
-class AutoDataModelTrainerCore:
+# 模型库（catboost、lightgbm、xgboost、sklearn 各模型与 scipy.stats）体积较大，仅在注册表实际用到时按需导入
+if TYPE_CHECKING:
+    from sklearn.base import BaseEstimator
+
+# 模型名称与模型类导入路径（"模块:类名"）的对应关系
+DICT_MODE_PATH = {
+    "Ridge": "sklearn.linear_model:Ridge",
+    "Lasso": "sklearn.linear_model:Lasso",
+    "ElasticNet": "sklearn.linear_model:ElasticNet",
+    "PLSReg": "sklearn.cross_decomposition:PLSRegression",
+    "XGBoostReg": "xgboost:XGBRegressor",
+    "LightGBMReg": "lightgbm:LGBMRegressor",
+    "CatBoostReg": "catboost:CatBoostRegressor",
+    "MLPRegressor": "sklearn.neural_network:MLPRegressor",
+    "KNNReg": "sklearn.neighbors:KNeighborsRegressor"
+    }
+
+
+@lru_cache(maxsize=None)
+def resolve_model_class(clas_path: str):
+    """
+    按 "模块:类名" 路径延迟导入模型类（同一路径只导入一次）。
+    Lazily import a model class from a "module:ClassName" path; each path is imported only once.
+    :param clas_path: Import path such as "xgboost:XGBRegressor".
+    :return: The model class.
     """
+    name_modu, name_clas = clas_path.split(":")
+    return getattr(importlib.import_module(name_modu), name_clas)
+
 
+class RuntimeContext:
+    """
+    运行时共享上下文：路径配置、日志管理器与模型注册表配置只构造一次，
+    并注入 AutoDataModelTrainerCore 与 DataPreprocessing，避免重复遍历目录、重复创建日志文件和重复解析注册表。
+    Shared runtime context: paths, the logger and the model registry configuration are built once and injected into
+    AutoDataModelTrainerCore and DataPreprocessing, so directories are checked, the log file is opened and the registry
+    is parsed only once per process.
     """
 
     def __init__(self):
-        """
-
-        """
         # 初始化基础路径（获取项目根目录的父级目录）
         self.base_path = Path(sys.argv[0]).resolve().parent.parent
         # 检查点存储路径（保存训练好的模型）
@@ -61,10 +87,8 @@ class AutoDataModelTrainerCore:
         self._init_directories()
         # 模型注册表配置文件名
         self.name_regi = "sets_mode_regi.json"
-        # 加载模型注册表配置
-        self.regi_mode = self._init_model_registry()
-        # 单模型最大训练尝试次数
-        self.retr_maxm = 3
+        # 加载模型注册表配置（原始JSON内容）
+        self.regi_data = self._init_registry_config()
 
     def _init_directories(self):
         """
@@ -137,6 +161,65 @@ class AutoDataModelTrainerCore:
         self.root_logg.info("✅ 日志系统初始化完成。")
         return self.root_logg
 
+    def _init_registry_config(self) -> Dict[str, dict]:
+        """
+        读取模型注册表配置文件。
+        Read the model registry configuration file.
+        :return: Parsed content of sets_mode_regi.json.
+        :raises FileNotFoundError: If the registry file does not exist.
+        """
+        # 构造注册表文件的完整路径
+        regi_path = Path(self.sets_path, self.name_regi)
+        # 检查注册表文件是否存在
+        if not regi_path.exists():
+            # 如果文件不存在，记录警告日志
+            self.root_logg.error(f"❗ 注册表文件缺失：{self.name_regi}")
+            # 抛出错误代码
+            raise FileNotFoundError(f"❗ 模型注册表文件 {self.name_regi} 未找到")
+        # 打开注册表文件并加载其内容
+        with open(regi_path, "r", encoding="utf-8") as regi_file:
+            # 使用json模块加载文件内容
+            return js.load(regi_file)
+
+
+class AutoDataModelTrainerCore:
+    """
+
+    """
+
+    def __init__(self, runt_ctxt: RuntimeContext = None):
+        """
+        :param runt_ctxt: 共享运行时上下文，未传入时新建。Shared runtime context; a new one is created if omitted.
+        """
+        # 共享运行时上下文（路径、日志、注册表配置）
+        self.runt_ctxt = runt_ctxt or RuntimeContext()
+        self.base_path = self.runt_ctxt.base_path
+        self.ckpt_path = self.runt_ctxt.ckpt_path
+        self.data_path = self.runt_ctxt.data_path
+        self.logs_path = self.runt_ctxt.logs_path
+        self.mode_path = self.runt_ctxt.mode_path
+        self.rezu_path = self.runt_ctxt.rezu_path
+        self.sets_path = self.runt_ctxt.sets_path
+        self.root_logg = self.runt_ctxt.root_logg
+        self.name_regi = self.runt_ctxt.name_regi
+        # 加载模型注册表配置
+        self.regi_mode = self._init_model_registry()
+        # 注册表中声明的超参数搜索空间（para_spac，未声明的模型不参与搜索）
+        self.spac_mode = {
+            mode_name: conf_mode["para_spac"] for mode_name, conf_mode in self.runt_ctxt.regi_data.items()
+            if conf_mode.get("para_spac")
+            }
+        # 单模型最大训练尝试次数
+        self.retr_maxm = 3
+        # 训练网格并行任务数（1为串行，-1为全部核心）
+        self.jobs_numb = 1
+        # 重试随机种子基数（第k次尝试使用 seed_base + k - 1）
+        self.seed_base = 42
+        # 早停轮数（验证集指标连续未改善的迭代/轮次数）
+        self.stop_rond = 20
+        # 单模型训练时间预算（秒，None为不限制，超出后不再发起新的尝试）
+        self.time_budg = None
+
     def _init_model_registry(self) -> Dict[str, dict]:
         """
         初始化模型注册表，加载注册表文件并构建模型的初始化函数与参数配置的映射关系。
@@ -160,18 +243,8 @@ class AutoDataModelTrainerCore:
                  parameter configuration) as the value.
         :rtype: dict[str, tuple[callable, dict]]
         """
-        # 构造注册表文件的完整路径
-        regi_path = Path(self.sets_path, self.name_regi)
-        # 检查注册表文件是否存在
-        if not regi_path.exists():
-            # 如果文件不存在，记录警告日志
-            self.root_logg.error(f"❗ 注册表文件缺失：{self.name_regi}")
-            # 抛出错误代码
-            raise FileNotFoundError(f"❗ 模型注册表文件 {self.name_regi} 未找到")
-        # 打开注册表文件并加载其内容
-        with open(regi_path, "r", encoding="utf-8") as regi_file:
-            # 使用json模块加载文件内容
-            regi_data = js.load(regi_file)
+        # 注册表配置已由运行时上下文读取
+        regi_data = self.runt_ctxt.regi_data
         # 初始化注册字典
         dict_mode_regi = {}
         # 加载模型名称与配置
@@ -215,22 +288,11 @@ class AutoDataModelTrainerCore:
         :raises ValueError: 如果提供的模型名称不在支持的模型列表中，则抛出此异常。
         """
         mode_name = para_mode.pop("mode_name")  # 从参数字典中移除并获取键为"mode_name"的值，该值代表模型名称
-        # 定义模型字典
-        dict_mode = {
-            "Ridge": Ridge,  # 将字符串"Ridge"映射到Ridge类
-            "Lasso": Lasso,  # 将字符串"Lasso"映射到Lasso类
-            "ElasticNet": ElasticNet,  # 将字符串"ElasticNet"映射到ElasticNet类
-            "PLSReg": PLSRegression,  # 将字符串"PLSReg"映射到PLSRegression类
-            "XGBoostReg": XGBRegressor,  # 将字符串"XGBoostReg"映射到XGBRegressor类
-            "LightGBMReg": LGBMRegressor,  # 将字符串"LightGBMReg"映射到LGBMRegressor类
-            "CatBoostReg": CatBoostRegressor,  # 将字符串"CatBoostReg"映射到CatBoostRegressor类
-            "MLPRegressor": MLPRegressor,  # 将字符串"MLPRegressor"映射到MLPRegressor类
-            "KNNReg": KNeighborsRegressor  # 将字符串"KNNReg"映射到KNeighborsRegressor类
-            }
-        if mode_name not in dict_mode:  # 检查提供的模型名称是否不在支持的模型字典中
+        if mode_name not in DICT_MODE_PATH:  # 检查提供的模型名称是否不在支持的模型字典中
             self.root_logg.error(f"❌ 不支持的模型：{mode_name}。")  # 如果模型不被支持，记录错误日志信息
             raise ValueError(f"❌ 不支持的模型：{mode_name}。")  # 抛出一个ValueError异常，提示模型不被支持
-        mode_objt = dict_mode[mode_name](**para_mode)  # 使用提供的参数实例化对应的模型对象
+        mode_clas = resolve_model_class(DICT_MODE_PATH[mode_name])  # 首次使用时才导入对应的模型库
+        mode_objt = mode_clas(**para_mode)  # 使用提供的参数实例化对应的模型对象
         self.root_logg.info(f"✅ 模型：{mode_name}，已初始化完成。")  # 记录模型初始化信息
         print(f"✅ 模型：{mode_name}成功载入，准备开始训练。")  # 在控制台打印开始训练信息
         return mode_objt
@@ -246,7 +308,7 @@ class AutoDataModelTrainerCore:
         else:
             self.root_logg.info(f"✅ 模型：{mode_name}，已初始化完成。")
             print(f"✅ 模型：{mode_name}成功载入，准备开始训练。")
-        mode_objt = SVR(**para_mode)
+        mode_objt = resolve_model_class("sklearn.svm:SVR")(**para_mode)
         return mode_objt
 
     def _init_gp_model(self, **para_mode) -> BaseEstimator:
@@ -254,6 +316,8 @@ class AutoDataModelTrainerCore:
         mode_name = para_mode.pop("mode_name")
         kern_sets = para_mode.pop("kernel", {})
         base_kern = para_mode.pop("base_kernel", "RBF")
+        from sklearn.gaussian_process import GaussianProcessRegressor
+        from sklearn.gaussian_process.kernels import RBF, WhiteKernel
         kern_type = {
             "RBF": RBF(length_scale=kern_sets.get("length_scale", 1.0)),
             "WhiteKernel": WhiteKernel(noise_level=kern_sets.get("noise_level", 1.0)),
@@ -263,7 +327,144 @@ class AutoDataModelTrainerCore:
         print(f"✅ 模型：{mode_name}成功载入，准备开始训练。")
         return mode_objt
 
-    def _train_single_model(self, mode_name: str, dict_spli: Dict[str, Any]) -> Dict[str, Any]:
+    @staticmethod
+    def _limit_model_threads(objt_mode: BaseEstimator, thre_numb: int) -> None:
+        """
+        限制模型内部线程池大小（XGBoost/LightGBM/KNN 的 n_jobs，CatBoost 的 thread_count），
+        避免进程池中每个任务再各自占满全部核心造成超额订阅。
+        Cap the model's internal thread pool so that jobs running in a process pool do not oversubscribe the cores.
+        :param objt_mode: Initialized estimator.
+        :param thre_numb: Maximum number of threads the estimator may use.
+        :return: None
+        """
+        if type(objt_mode).__name__.startswith("CatBoost"):
+            objt_mode.set_params(thread_count=thre_numb)
+        elif "n_jobs" in objt_mode.get_params():
+            objt_mode.set_params(n_jobs=thre_numb)
+
+    @staticmethod
+    def _seed_model(objt_mode: BaseEstimator, seed_numb: int) -> bool:
+        """
+        为模型设置随机种子（CatBoost 的 random_seed，其余模型的 random_state），使每次重试探索不同的随机初始化。
+        Set the estimator's random seed so that each retry explores a different random initialisation.
+        :param objt_mode: Initialized estimator.
+        :param seed_numb: Seed for this attempt.
+        :return: False if the estimator has no seed parameter (retrying it would repeat the same fit).
+        """
+        if type(objt_mode).__name__.startswith("CatBoost"):
+            objt_mode.set_params(random_seed=seed_numb)
+            return True
+        if "random_state" in objt_mode.get_params():
+            objt_mode.set_params(random_state=seed_numb)
+            return True
+        return False
+
+    def _fit_with_early_stopping(self, objt_mode: BaseEstimator, tran_sets: tuple, vali_sets: tuple) -> int:
+        """
+        训练模型；XGBoost/LightGBM/CatBoost 以验证集指标早停，MLP 逐轮 partial_fit 并保留验证集R²最优的权重，
+        其余模型（或验证集为空时）直接 fit。
+        Fit the estimator. Boosters stop early on the validation metric; the MLP is trained epoch by epoch with
+        partial_fit and keeps the weights with the best validation R². Other estimators (or an empty validation
+        set) fall back to a plain fit.
+        :param objt_mode: Initialized estimator.
+        :param tran_sets: (X, y) training split.
+        :param vali_sets: (X, y) validation split.
+        :return: Number of boosting rounds/epochs actually kept, or None for a plain fit.
+        """
+        x_train, y_train = tran_sets
+        x_vali, y_vali = vali_sets
+        name_clas = type(objt_mode).__name__
+        if len(y_vali) == 0:
+            objt_mode.fit(x_train, y_train)
+            return None
+        if name_clas.startswith("XGB"):
+            objt_mode.set_params(early_stopping_rounds=self.stop_rond)
+            objt_mode.fit(x_train, y_train, eval_set=[(x_vali, y_vali)], verbose=False)
+            return objt_mode.best_iteration + 1
+        if name_clas.startswith("LGBM"):
+            earl_stop = resolve_model_class("lightgbm:early_stopping")
+            objt_mode.fit(
+                    x_train, y_train, eval_set=[(x_vali, y_vali)],
+                    callbacks=[earl_stop(self.stop_rond, verbose=False)]
+                    )
+            return objt_mode.best_iteration_ or objt_mode.n_estimators
+        if name_clas.startswith("CatBoost"):
+            objt_mode.fit(
+                    x_train, y_train, eval_set=(x_vali, y_vali), early_stopping_rounds=self.stop_rond,
+                    use_best_model=True, verbose=False
+                    )
+            return objt_mode.get_best_iteration() + 1
+        if name_clas == "MLPRegressor" and objt_mode.solver in ("adam", "sgd"):
+            # partial_fit 不支持 sklearn 内置早停（改由本函数按验证集R²早停）
+            if objt_mode.early_stopping:
+                self.root_logg.warning("❕ MLPRegressor 的 early_stopping=True 与逐轮训练冲突，已改为按验证集R²早停")
+                objt_mode.set_params(early_stopping=False)
+            best_scor, best_epoc, best_wegt = -np.inf, 0, None
+            for vari_epoc in range(1, objt_mode.max_iter + 1):
+                objt_mode.partial_fit(x_train, y_train)
+                vali_scor = objt_mode.score(x_vali, y_vali)
+                if vali_scor > best_scor:
+                    best_scor, best_epoc = vali_scor, vari_epoc
+                    best_wegt = ([coef.copy() for coef in objt_mode.coefs_],
+                                 [inte.copy() for inte in objt_mode.intercepts_])
+                elif vari_epoc - best_epoc >= self.stop_rond:
+                    break
+            # 恢复验证集表现最优一轮的权重；各轮验证集R²均无效（如验证集目标值为常数）时保留最后一轮的权重
+            if best_wegt is None:
+                return vari_epoc
+            objt_mode.coefs_, objt_mode.intercepts_ = best_wegt
+            return best_epoc
+        objt_mode.fit(x_train, y_train)
+        return None
+
+    @staticmethod
+    def _save_checkpoint_meta(path_ckpt: Path, mode_name: str, para_tran: Dict[str, Any], dict_spli: Dict[str, Any],
+                              dict_resu: Dict[str, Any]) -> None:
+        """
+        在检查点旁写入同名 .json 元数据（特征构建方式、模型参数、评估结果），降维对象另存为 .redu.joblib，
+        供 mode_PRED_Serv 载入检查点后按训练时相同的方式构建特征。
+        Write a .json sidecar next to the checkpoint (feature recipe, model parameters, scores); a fitted reduction
+        is dumped to .redu.joblib. mode_PRED_Serv uses them to rebuild features exactly as in training.
+        """
+        from joblib import dump
+
+        dict_meta = {
+            "mode_name": mode_name,
+            "para_conf": {name: valu for name, valu in para_tran.items() if name != "mode_name"},
+            "feat_meta": dict_spli.get("feat_meta", {}),
+            "best_r2": float(dict_resu["best_r2"]),
+            "redu_file": None
+            }
+        if dict_spli.get("redu_objt") is not None:
+            path_redu = path_ckpt.with_suffix(".redu.joblib")
+            dump(dict_spli["redu_objt"], path_redu)
+            dict_meta["redu_file"] = path_redu.name
+        with open(path_ckpt.with_suffix(".json"), "w", encoding="utf-8") as file_meta:
+            js.dump(dict_meta, file_meta, ensure_ascii=False, indent=2, default=str)
+
+    def _train_single_model(self, mode_name: str, dict_spli: Dict[str, Any], thre_numb: int = None,
+                            para_over: Dict[str, Any] = None, save_ckpt: bool = True,
+                            retr_maxm: int = None, batc_eval: bool = False) -> Dict[str, Any]:
+        """
+        训练单个模型：最多 retr_maxm 次尝试，每次使用不同随机种子并以验证集早停；
+        模型无随机种子参数、两次结果完全一致或超出 time_budg 时提前结束重试，非最佳尝试的耗时记为浪费的计算量。
+        Train one model with up to retr_maxm attempts, each with its own seed and validation-driven early stopping.
+        Retries stop early when the model has no seed, repeats the previous result exactly, or exceeds time_budg;
+        time spent on attempts that did not produce the kept model is logged as wasted compute.
+        :param mode_name: Registered model name.
+        :param dict_spli: {"tran_sets"/"vali_sets"/"test_sets": (X, y)}.
+        :param thre_numb: Optional cap on the model's internal threads.
+        :param para_over: Parameters overriding the registry's para_conf (used by the hyperparameter search).
+        :param save_ckpt: Whether to dump the kept model to ckpt/.
+        :param retr_maxm: Attempt limit for this call; defaults to self.retr_maxm.
+        :param batc_eval: True when the caller evaluates metrics in batch (cross-validation): the kept model's test
+                          predictions are returned under "pred_test" instead of computing RMSE/sMAPE/KS/NSE here.
+        :return: Result dict (status, best test/validation R², kept attempt, checkpoint path, rounds kept,
+                 wasted seconds, test metrics of the kept model).
+        """
+        from joblib import dump
+        from sklearn.metrics import r2_score
+
         self.root_logg.info(f"▶ 开始训练模型：{mode_name}")
         if mode_name not in self.regi_mode:
             self.root_logg.error(f"❌ 未注册的模型：{mode_name}")
@@ -276,31 +477,52 @@ class AutoDataModelTrainerCore:
             "stts_train": "未达标",
             "best_r2": -np.inf,
             "n_retry": 0,
-            "path_ckpt": None
+            "path_ckpt": None,
+            "vali_r2": np.nan,
+            "iter_best": None,
+            "time_wast": 0.0,
+            "rmse": np.nan,
+            "smape": np.nan,
+            "ks": np.nan,
+            "nse": np.nan
             }
-        rmse = 0
-        smape = 0
-        ksa = 0
-        nse = 0
-        para_tran = {'mode_name': mode_name, **para_conf}
+        para_tran = {'mode_name': mode_name, **para_conf, **(para_over or {})}
+        retr_maxm = retr_maxm or self.retr_maxm
         best_model = None
-        for vari_atte in range(1, self.retr_maxm + 1):
+        best_pred = None
+        last_r2 = None
+        # 各次尝试耗时，用于统计浪费的计算量
+        list_cost = []
+        best_cost = 0.0
+        time_star = time.perf_counter()
+        for vari_atte in range(1, retr_maxm + 1):
+            if self.time_budg is not None and vari_atte > 1 and time.perf_counter() - time_star >= self.time_budg:
+                self.root_logg.info(f"❕ 已用尽时间预算 {self.time_budg}秒，停止重试")
+                break
+            atte_star = time.perf_counter()
             try:
-                self.root_logg.info(f"🔄 尝试第 {vari_atte}/{self.retr_maxm} 次训练")
+                self.root_logg.info(f"🔄 尝试第 {vari_atte}/{retr_maxm} 次训练")
                 print(f"正在尝试 {mode_name} 第 {vari_atte} 次训练...")
                 # 模型初始化
                 objt_mode = func_init(**para_tran)
-                objt_mode.fit(x_train, y_train)
+                if thre_numb:
+                    self._limit_model_threads(objt_mode, thre_numb)
+                has_seed = self._seed_model(objt_mode, self.seed_base + vari_atte - 1)
+                iter_best = self._fit_with_early_stopping(objt_mode, (x_train, y_train), dict_spli["vali_sets"])
                 # 性能评估
                 y_pred = objt_mode.predict(x_test)
                 current_r2 = r2_score(y_test, y_pred)
+                list_cost.append(time.perf_counter() - atte_star)
                 # 更新最佳结果
                 if current_r2 > dict_resu['best_r2']:
                     best_model = objt_mode
+                    best_pred = y_pred
+                    best_cost = list_cost[-1]
                     dict_resu.update(
                             {
                                 'best_r2': current_r2,
-                                'n_retry': vari_atte
+                                'n_retry': vari_atte,
+                                'iter_best': iter_best
                                 }
                             )
                     self.root_logg.info(f"📈 更新最佳R²值：{current_r2:.6f}")
@@ -309,21 +531,38 @@ class AutoDataModelTrainerCore:
                     dict_resu['stts_train'] = '达标'
                     self.root_logg.info(f"✅ 第 {vari_atte} 次尝试达标")
                     break
-                rmse = np.sqrt(np.mean((y_test - y_pred)**2))
-                smape = np.mean(2 * np.abs(y_pred - y_test) / (np.abs(y_test) + np.abs(y_pred))) * 100
-                ksa, _ = ks_2samp(y_test, y_pred)
-                nse = 1 - (np.sum((y_test - y_pred)**2) / np.sum((y_test - np.mean(y_test))**2))
+                # 确定性模型重试只会得到相同结果
+                if not has_seed or current_r2 == last_r2:
+                    self.root_logg.info(f"❕ {mode_name} 对随机种子不敏感，停止重试")
+                    break
+                last_r2 = current_r2
             except Exception as e:
+                list_cost.append(time.perf_counter() - atte_star)
                 error_msg = f"❌ 第 {vari_atte} 次训练失败：{str(e)}"
                 self.root_logg.error(error_msg)
                 print(error_msg)
-                # 模型持久化
-        if best_model and dict_resu['best_r2'] > -np.inf:
+        # 非最佳尝试（含失败尝试）的耗时
+        dict_resu['time_wast'] = sum(list_cost) - best_cost
+        x_vali, y_vali = dict_spli["vali_sets"]
+        if best_model and len(y_vali):
+            dict_resu['vali_r2'] = r2_score(y_vali, best_model.predict(x_vali))
+        # 只对最终保留的模型计算一次测试集指标
+        if batc_eval:
+            dict_resu['pred_test'] = best_pred
+        elif best_pred is not None:
+            dict_metr = BatchMetricEvaluator().evaluate([best_pred], y_test)
+            dict_resu.update({metr_name: float(dict_metr[metr_name][0]) for metr_name in ("rmse", "smape", "ks", "nse")})
+        # 模型持久化
+        if save_ckpt and best_model and dict_resu['best_r2'] > -np.inf:
             stri_time = dt.datetime.now().strftime("%Y%m%d_%H%M%S")
-            file_name = f"{mode_name}_{stri_time}.joblib"
+            feat_meta = dict_spli.get("feat_meta", {})
+            # 文件名包含特征集名称（DataPreprocessing.run() 的键），避免同一秒内不同特征集的同名模型互相覆盖
+            feat_name = feat_meta.get("feat_name") or feat_meta.get("func_name") or feat_meta.get("feat_mode", "feat")
+            file_name = f"{mode_name}_{feat_name}_{stri_time}.joblib"
             path_ckpt = Path(self.ckpt_path, file_name)
             try:
                 dump(best_model, path_ckpt)
+                self._save_checkpoint_meta(path_ckpt, mode_name, para_tran, dict_spli, dict_resu)
                 dict_resu['path_ckpt'] = str(path_ckpt)
                 self.root_logg.info(f"💾 检查点已保存至：{path_ckpt}")
             except Exception as e:
@@ -333,52 +572,385 @@ class AutoDataModelTrainerCore:
                 # 训练结果记录
         self.root_logg.info(
                 f"▷ 训练完成：{mode_name} | 状态：{dict_resu['stts_train']} | "
-                f"最佳R²：{dict_resu['best_r2']:.4f}|RMSE:{rmse:.4f}|sMAPE:{smape:.4f} |KS:{ksa:.4f}|NSE:{nse:.4f}| 尝试次数：{dict_resu['n_retry']}"
+                f"最佳R²：{dict_resu['best_r2']:.4f}|RMSE:{dict_resu['rmse']:.4f}|sMAPE:{dict_resu['smape']:.4f} |"
+                f"KS:{dict_resu['ks']:.4f}|NSE:{dict_resu['nse']:.4f}| 尝试次数：{dict_resu['n_retry']}"
+                )
+        self.root_logg.info(
+                f"⏱ {mode_name} | 尝试 {len(list_cost)} 次 | 总耗时：{sum(list_cost):.2f}秒 | "
+                f"浪费计算：{dict_resu['time_wast']:.2f}秒 | 保留轮数：{dict_resu['iter_best']}"
                 )
 
         return dict_resu
 
-    def run(self):
-        spli_data = DataPreprocessing().run()
-        for func_name in spli_data.keys():
-            func_data = spli_data[func_name]
-            for mode_name in self.regi_mode.keys():
-                self._train_single_model(mode_name, func_data)
+    def _run_grid_job(self, func_name: str, mode_name: str, dict_spli: Dict[str, Any],
+                      thre_numb: int = None) -> Dict[str, Any]:
+        """
+        训练网格中的单个任务（植被指数 × 模型），返回带耗时的结果行。
+        同一任务内的重试依赖前一次结果（达标即停止），因此在任务内部顺序执行。
+        Run one (index, model) job of the training grid and return its result row including the time spent.
+        Retries inside a job depend on the previous attempt (they stop once the target is met) and stay sequential.
+        """
+        time_star = time.perf_counter()
+        dict_resu = self._train_single_model(mode_name, dict_spli, thre_numb)
+        return {
+            "func_name": func_name,
+            "mode_name": mode_name,
+            **dict_resu,
+            "time_cost": time.perf_counter() - time_star
+            }
 
+    def run(self, jobs_numb: int = None, **prep_conf):
+        """
+        训练全部植被指数 × 模型组合。jobs_numb 大于1时通过 joblib(loky) 进程池并行，各任务内部模型线程数限制为1；
+        全部结果汇总为一张表写入 results 目录，并记录相对串行的加速比。
+        Train every (index, model) combination. With jobs_numb > 1 the jobs are spread over a joblib (loky) process
+        pool and each model is limited to one thread; all results are collected into one table under results/ and the
+        speed-up over serial execution is logged.
+        :param jobs_numb: Number of parallel jobs (-1 for all cores); defaults to self.jobs_numb.
+        :param prep_conf: Feature options forwarded to DataPreprocessing (feat_mode, band_topk, redu_mode, comp_numb).
+        :return: pandas.DataFrame with one row per (index, model) job.
+        """
+        from joblib import Parallel, delayed
 
-class DataPreprocessing:
-    def __init__(self):
+        jobs_numb = jobs_numb or self.jobs_numb
+        spli_data = DataPreprocessing(self.runt_ctxt, **prep_conf).run()
+        list_jobs = [(func_name, mode_name) for func_name in spli_data.keys() for mode_name in self.regi_mode.keys()]
+        self.root_logg.info(f"▶ 训练网格：{len(spli_data)} 个指数 × {len(self.regi_mode)} 个模型，并行任务数：{jobs_numb}")
+        time_star = time.perf_counter()
+        if jobs_numb == 1:
+            list_rezu = [
+                self._run_grid_job(func_name, mode_name, spli_data[func_name]) for func_name, mode_name in list_jobs
+                ]
+        else:
+            list_rezu = Parallel(n_jobs=jobs_numb, backend="loky")(
+                    delayed(self._run_grid_job)(func_name, mode_name, spli_data[func_name], 1)
+                    for func_name, mode_name in list_jobs
+                    )
+        time_wall = time.perf_counter() - time_star
+        rezu_tabl = pd.DataFrame(list_rezu)
+        # 串行耗时按各任务耗时之和估计
+        time_seri = float(rezu_tabl["time_cost"].sum()) if len(rezu_tabl) else 0.0
+        stri_time = dt.datetime.now().strftime("%Y%m%d_%H%M%S")
+        path_tabl = write_results_table(rezu_tabl, Path(self.rezu_path, f"Tran_Grid_{stri_time}"), self.root_logg)
+        time_wast = float(rezu_tabl["time_wast"].sum()) if len(rezu_tabl) else 0.0
+        self.root_logg.info(
+                f"▷ 训练网格完成：{len(list_jobs)} 个任务 | 墙钟耗时：{time_wall:.2f}秒 | 任务耗时合计：{time_seri:.2f}秒 | "
+                f"加速比：{time_seri / time_wall if time_wall > 0 else 0.0:.2f}x | 重试浪费：{time_wast:.2f}秒 | 结果表：{path_tabl}"
+                )
+        return rezu_tabl
+
+    def _run_fold_job(self, func_name: str, mode_name: str, path_full: str, fold_rows: Dict[str, np.ndarray],
+                      fold_indx: int, thre_numb: int = None, feat_conf: Dict[str, Any] = None) -> Dict[str, Any]:
         """
+        交叉验证中的单个任务（指数 × 模型 × 折）：以只读内存映射打开共享的全量矩阵，按行号数组取出该折数据
+        （需要时在折内拟合波段筛选与降维）并训练一次。
+        Run one (index, model, fold) job: open the shared full matrix as a read-only memory map, gather this fold's
+        rows by index arrays (fitting band selection / reduction inside the fold when configured) and train once.
+        """
+        from joblib import load
+
+        time_star = time.perf_counter()
+        dict_spli = DataPreprocessing.fold_features(load(path_full, mmap_mode="r"), fold_rows, feat_conf)
+        dict_resu = self._train_single_model(
+                mode_name, dict_spli, thre_numb, save_ckpt=False, retr_maxm=1, batc_eval=True
+                )
+        return {
+            "func_name": func_name,
+            "mode_name": mode_name,
+            "fold_indx": fold_indx,
+            "pred_test": dict_resu["pred_test"],
+            "vali_r2": dict_resu["vali_r2"],
+            "iter_best": dict_resu["iter_best"],
+            "time_cost": time.perf_counter() - time_star
+            }
 
+    def cross_validate(self, fold_numb: int = 5, grup_freq: str = None, jobs_numb: int = None,
+                       **prep_conf) -> pd.DataFrame:
+        """
+        K折交叉验证全部 指数 × 模型 组合。折行号只计算一次；每个特征集的全量矩阵只写出一次临时文件，
+        各任务以只读内存映射共享（不随任务序列化），只按行号取出本折数据。全部 (指数, 模型, 折) 任务通过 joblib(loky)
+        并行；每折只训练一次（不按测试折挑选重试结果），各组合的R²以均值 ± 标准差汇总，逐折结果写入 results 目录。
+        "ranked" 波段筛选与 PCA/PLS 降维在每折训练集上重新拟合，测试折不参与特征构建。
+        K-fold cross-validate every (index, model) combination. Fold indices are computed once; each feature set's full
+        matrix is dumped once to a temporary file and every job opens it as a read-only memory map (nothing large is
+        pickled per task) and gathers only its fold's rows. All (index, model, fold) jobs run on a joblib (loky) pool.
+        Each fold is trained once (retries are not picked on the test fold). The test metrics of all folds are computed
+        in one batched call, reported as mean ± standard deviation per combination, and the per-fold table is written
+        under results/. Ranked band selection and PCA/PLS are refit on each fold's training rows, so the test fold
+        never takes part in building the features.
+        :param fold_numb: Number of folds.
+        :param grup_freq: Optional pandas frequency to group samples by sampling time (see build_fold_indices).
+        :param jobs_numb: Number of parallel jobs (-1 for all cores); defaults to self.jobs_numb.
+        :param prep_conf: Feature options forwarded to DataPreprocessing.
+        :return: pandas.DataFrame with the mean and standard deviation per (index, model).
         """
+        from joblib import Parallel, delayed, dump
 
-        self.base_path = AutoDataModelTrainerCore().base_path
-        self.data_path = AutoDataModelTrainerCore().rezu_path
-        self.sets_path = AutoDataModelTrainerCore().sets_path
+        jobs_numb = jobs_numb or self.jobs_numb
+        data_prep = DataPreprocessing(self.runt_ctxt, **prep_conf)
+        feat_conf = None
+        if data_prep.feat_mode == "ranked" or data_prep.redu_mode:
+            # 波段筛选与降维不在留出训练集上预先拟合，而是在每折训练集上重新拟合
+            feat_conf = {
+                "feat_mode": data_prep.feat_mode, "band_topk": data_prep.band_topk,
+                "redu_mode": data_prep.redu_mode, "comp_numb": data_prep.comp_numb
+                }
+            spli_data = {
+                data_prep.spectrum_feature_name(): {
+                    "full_sets": (
+                        np.ascontiguousarray(data_prep.dict_refl.band_matx, dtype=np.float32),
+                        np.asarray(data_prep.dict_refl.spad_vect, dtype=np.float64)
+                        )
+                    }
+                }
+        else:
+            spli_data = data_prep.run()
+        list_fold = data_prep.build_fold_indices(fold_numb, grup_freq)
+        list_jobs = [
+            (func_name, mode_name, fold_indx) for func_name in spli_data.keys() for mode_name in self.regi_mode.keys()
+            for fold_indx in range(len(list_fold))
+            ]
+        self.root_logg.info(
+                f"▶ 交叉验证：{len(spli_data)} 个指数 × {len(self.regi_mode)} 个模型 × {len(list_fold)} 折，"
+                f"并行任务数：{jobs_numb}"
+                )
+        time_star = time.perf_counter()
+        thre_numb = 1 if jobs_numb != 1 else None
+        # 每个特征集的全量矩阵只写出一次，任务中以只读内存映射打开
+        path_temp = tempfile.mkdtemp(prefix="Tran_Cv_", dir=self.rezu_path)
+        try:
+            dict_path = {}
+            for spli_indx, func_name in enumerate(spli_data.keys()):
+                dict_path[func_name] = str(Path(path_temp, f"full_sets_{spli_indx}.joblib"))
+                dump(spli_data[func_name]["full_sets"], dict_path[func_name])
+            list_rezu = Parallel(n_jobs=jobs_numb, backend="loky")(
+                    delayed(self._run_fold_job)(
+                            func_name, mode_name, dict_path[func_name], list_fold[fold_indx], fold_indx, thre_numb,
+                            feat_conf
+                            )
+                    for func_name, mode_name, fold_indx in list_jobs
+                    )
+        finally:
+            shutil.rmtree(path_temp, ignore_errors=True)
+        # 全部 (模型 × 折) 的测试集预测一次批量计算指标（失败的任务以空向量代替，指标为NaN）
+        list_pred = [rezu_rows.pop("pred_test") for rezu_rows in list_rezu]
+        list_targ = [
+            spli_data[func_name]["full_sets"][1][list_fold[fold_indx]["test_sets"]]
+            for func_name, _, fold_indx in list_jobs
+            ]
+        list_pred = [np.empty(0) if pred_vect is None else pred_vect for pred_vect in list_pred]
+        fold_tabl = BatchMetricEvaluator().evaluate_frame(list_pred, list_targ, list_rezu)
+        stri_time = dt.datetime.now().strftime("%Y%m%d_%H%M%S")
+        path_tabl = write_results_table(fold_tabl, Path(self.rezu_path, f"Tran_Cv_{stri_time}"), self.root_logg)
+        summ_tabl = fold_tabl.groupby(["func_name", "mode_name"], sort=False).agg(
+                **{
+                    f"{metr_name}_{aggr_name}": (metr_name, aggr_name)
+                    for metr_name in [*LIST_METR_NAME, "vali_r2"] for aggr_name in ("mean", "std")
+                    },
+                fold_fail=("r2", lambda seri: int(seri.isna().sum()))
+                ).reset_index()
+        for summ_rows in summ_tabl.itertuples(index=False):
+            self.root_logg.info(
+                    f"▷ {summ_rows.func_name} × {summ_rows.mode_name} | 测试R²：{summ_rows.r2_mean:.4f} ± "
+                    f"{summ_rows.r2_std:.4f} | RMSE：{summ_rows.rmse_mean:.4f} ± {summ_rows.rmse_std:.4f} | "
+                    f"验证R²：{summ_rows.vali_r2_mean:.4f} ± {summ_rows.vali_r2_std:.4f}"
+                    )
+        self.root_logg.info(
+                f"▷ 交叉验证完成：{len(list_jobs)} 个任务 | 墙钟耗时：{time.perf_counter() - time_star:.2f}秒 | "
+                f"逐折结果：{path_tabl}"
+                )
+        return summ_tabl
+
+
+class VegetationIndexCompiler:
+    """
+    植被指数公式编译器：将 sets_data_func.json 中的公式（如 "(@800-@680)/(@800+@680)"）解析为AST，
+    仅允许数值常量、波段引用与四则/乘方运算，编译为作用于整列NumPy波段数据的函数，不使用eval。
+    分母为0的位置结果为NaN。
+    Vegetation index compiler: parses a formula from sets_data_func.json into an AST that may only contain numeric
+    constants, band references and arithmetic operators, and compiles it into a function over whole NumPy band
+    columns without eval. Positions with a zero denominator evaluate to NaN.
+    """
+
+    # 波长引用的匹配模式（@后接波长数值）
+    wave_patn = re.compile(r"@(\d+\.?\d*)")
+    # 允许的二元、一元运算
+    bina_oper = {ast.Add: np.add, ast.Sub: np.subtract, ast.Mult: np.multiply, ast.Pow: np.power}
+    unar_oper = {ast.UAdd: np.positive, ast.USub: np.negative}
+
+    def __init__(self, band_reso):
+        # 波长到波段名称的解析函数（如 DataPreprocessing.find_closest_band）
+        self.band_reso = band_reso
+
+    def compile(self, func_stri: str) -> "IndexExpression":
+        """
+        解析并编译公式字符串。
+        :param func_stri: 植被指数公式字符串。
+        :return: 可调用的 IndexExpression，参数为“波段名称 → 列向量”的取值函数。
+        :raises ValueError: 公式包含不允许的语法元素时抛出。
+        """
+        name_band = {}
+        # 公式中的波长与解析得到的波段（随检查点保存，预测时无需重新匹配波段）
+        wave_band = {}
+
+        def repl_wave(matc_wave):
+            # 将 @波长 替换为合法的变量名，并记录其对应的波段
+            name_vari = "wave_" + matc_wave.group(1).replace(".", "_")
+            name_band[name_vari] = self.band_reso(float(matc_wave.group(1)))
+            wave_band[f"{float(matc_wave.group(1)):g}"] = name_band[name_vari]
+            return name_vari
+
+        stri_expr = self.wave_patn.sub(repl_wave, func_stri)
+        try:
+            tree_expr = ast.parse(stri_expr, mode="eval")
+        except SyntaxError as e:
+            raise ValueError(f"❌ 植被指数公式语法错误：{func_stri}") from e
+        func_eval = self._compile_node(tree_expr.body, name_band, func_stri)
+        return IndexExpression(func_stri, sorted(set(name_band.values())), func_eval, wave_band)
+
+    def _compile_node(self, node, name_band, func_stri):
+        """递归地将AST节点编译为闭包"""
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+            valu_cons = float(node.value)
+            return lambda band_getr: valu_cons
+        if isinstance(node, ast.Name) and node.id in name_band:
+            band_name = name_band[node.id]
+            return lambda band_getr: band_getr(band_name)
+        if isinstance(node, ast.UnaryOp) and type(node.op) in self.unar_oper:
+            func_oper = self.unar_oper[type(node.op)]
+            func_oprd = self._compile_node(node.operand, name_band, func_stri)
+            return lambda band_getr: func_oper(func_oprd(band_getr))
+        if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Div):
+            func_left = self._compile_node(node.left, name_band, func_stri)
+            func_righ = self._compile_node(node.right, name_band, func_stri)
+            return lambda band_getr: self._safe_divide(func_left(band_getr), func_righ(band_getr))
+        if isinstance(node, ast.BinOp) and type(node.op) in self.bina_oper:
+            func_oper = self.bina_oper[type(node.op)]
+            func_left = self._compile_node(node.left, name_band, func_stri)
+            func_righ = self._compile_node(node.right, name_band, func_stri)
+            return lambda band_getr: func_oper(func_left(band_getr), func_righ(band_getr))
+        raise ValueError(f"❌ 植被指数公式包含不支持的语法：{type(node).__name__}（{func_stri}）")
+
+    @staticmethod
+    def _safe_divide(valu_nume, valu_deno):
+        """逐元素除法，分母为0处返回NaN"""
+        valu_nume = np.asarray(valu_nume, dtype=np.float64)
+        valu_deno = np.asarray(valu_deno, dtype=np.float64)
+        rezu_data = np.full(np.broadcast(valu_nume, valu_deno).shape, np.nan)
+        np.divide(valu_nume, valu_deno, out=rezu_data, where=valu_deno != 0)
+        return rezu_data
+
+
+class IndexExpression:
+    """
+    编译后的植被指数：band_list 为公式引用的全部波段，调用时传入“波段名称 → 列向量”的取值函数。
+    Compiled vegetation index. ``band_list`` lists every band the formula references and ``wave_band`` maps each
+    wavelength of the formula to its band; call it with a function that maps a band name to its column vector.
+    """
+
+    def __init__(self, func_stri, band_list, func_eval, wave_band=None):
+        self.func_stri = func_stri
+        self.band_list = band_list
+        self.func_eval = func_eval
+        self.wave_band = wave_band or {}
+
+    def __call__(self, band_getr):
+        return np.asarray(self.func_eval(band_getr), dtype=np.float64)
+
+
+class ReflectanceColumnData:
+    """
+    列式反射率数据容器：band_matx 为 (样本数, 波段数) 的连续矩阵，spad_vect 为SPAD向量，sids_indx 为ID到行号的索引。
+    按ID取值时返回与旧版逐行字典相同结构的映射，便于既有代码按 ["Band_x"] 访问。
+    Columnar reflectance container. ``band_matx`` is a contiguous (samples, bands) matrix, ``spad_vect`` the SPAD
+    vector and ``sids_indx`` maps sample IDs to row numbers. Indexing by ID returns a row mapping shaped like the
+    former per-row dictionaries so existing ``["Band_x"]`` lookups keep working. ``time_list`` holds the sampling
+    time of each row when the table has a Time column (used for grouped cross-validation folds).
+    """
+
+    def __init__(self, band_name, band_matx, spad_vect, sids_list, time_list=None):
+        self.band_name = [str(name) for name in band_name]
+        self.band_matx = band_matx
+        self.spad_vect = spad_vect
+        self.sids_list = [str(sids) for sids in sids_list]
+        self.time_list = [str(time_stri) for time_stri in time_list] if time_list is not None and len(time_list) \
+            else None
+        self.band_indx = {name: numb for numb, name in enumerate(self.band_name)}
+        self.sids_indx = {sids: numb for numb, sids in enumerate(self.sids_list)}
+
+    def __len__(self):
+        return len(self.sids_list)
+
+    def __contains__(self, samp_sids):
+        return str(samp_sids) in self.sids_indx
+
+    def __getitem__(self, samp_sids):
+        rows_numb = self.sids_indx[str(samp_sids)]
+        rows_data = dict(zip(self.band_name, self.band_matx[rows_numb].tolist()))
+        rows_data.update({"ID": self.sids_list[rows_numb], "SPAD": float(self.spad_vect[rows_numb])})
+        return rows_data
+
+    def band_column(self, band_name):
+        """返回单个波段在全部样本上的列向量（视图，不复制）"""
+        return self.band_matx[:, self.band_indx[band_name]]
+
+
+class DataPreprocessing:
+    def __init__(self, runt_ctxt: RuntimeContext = None, feat_mode: str = "index", band_topk: int = 20,
+                 redu_mode: str = None, comp_numb: int = 10, seed_numb: int = 42):
+        """
+        :param runt_ctxt: 共享运行时上下文，未传入时新建。Shared runtime context; a new one is created if omitted.
+        :param feat_mode: 特征模式："index" 单植被指数，"spectrum" 全部波段，"ranked" 相关性排名前 band_topk 的波段。
+                          Feature mode: "index" (one vegetation index), "spectrum" (all bands) or "ranked" (top
+                          band_topk bands by correlation with SPAD).
+        :param band_topk: "ranked" 模式下保留的波段数。Number of bands kept in "ranked" mode.
+        :param redu_mode: 光谱特征的降维方式 None/"pca"/"pls"。Optional reduction of spectral features.
+        :param comp_numb: 降维后的成分数。Number of components after reduction.
+        :param seed_numb: 数据划分与交叉验证折的随机种子。Seed of the hold-out split and the cross-validation folds.
+        :raises ValueError: feat_mode 不是 "index"/"spectrum"/"ranked" 时抛出。If feat_mode is unknown.
+        """
+        runt_ctxt = runt_ctxt or RuntimeContext()
+        self.base_path = runt_ctxt.base_path
+        self.data_path = runt_ctxt.rezu_path
+        self.sets_path = runt_ctxt.sets_path
         self.band_name = "sets_band_wave.json"
         self.refl_name = "rezu_spad_refl.csv"
         self.func_name = "sets_data_func.json"
-        self.root_logg = AutoDataModelTrainerCore().root_logg
+        self.root_logg = runt_ctxt.root_logg
+        if feat_mode not in ("index", "spectrum", "ranked"):
+            self.root_logg.error(f"❌ 未知的特征模式：{feat_mode}（可选：index, spectrum, ranked）")
+            raise ValueError(f"❌ 未知的特征模式：{feat_mode}（可选：index, spectrum, ranked）")
         self.dict_refl = self._init_reflectance_csv()
         self.band_wave = self._init_gain_wave_band()
         self.tran_rati = 0.7
         self.vali_rati = 0.2
         self.test_rati = 0.1
+        self.seed_numb = seed_numb
         self.spli_dids = self._init_random_dataset_selector()
         self.func_data = self._init_fetch_formula_config()
+        # 特征构建配置
+        self.feat_mode = feat_mode
+        self.band_topk = band_topk
+        self.redu_mode = redu_mode
+        self.comp_numb = comp_numb
+        # 降维结果缓存（按降维方式、成分数与波段集合）
+        self.redu_cach = {}
+        # 交叉验证折行号缓存（按折数与分组频率）
+        self.fold_cach = {}
 
     def _init_random_dataset_selector(self):
         """
-
+        按 seed_numb 打乱数据表中实际存在的样本ID，并按比例划分为互不重叠的训练、验证、测试集。
+        Shuffle the sample IDs present in the data table with seed_numb and cut them into disjoint
+        train/validation/test sets by the configured ratios.
         """
-        data_sids = list(range(1, 241))
-        random.shuffle(data_sids)
+        data_sids = list(self.dict_refl.sids_list)
+        random.Random(self.seed_numb).shuffle(data_sids)
         tran_size = int(self.tran_rati * len(data_sids))
         vali_size = int(self.vali_rati * len(data_sids))
-        test_size = int(self.test_rati * len(data_sids))
         list_tran = data_sids[:tran_size]
         list_vali = data_sids[tran_size:(tran_size + vali_size)]
-        list_test = data_sids[test_size:]
+        list_test = data_sids[(tran_size + vali_size):]
         dict_spli = {
             "tran_sets": list_tran,
             "vali_sets": list_vali,
@@ -431,50 +1003,65 @@ class DataPreprocessing:
 
     def create_index_function(self, func_stri):
         """
-
+        将植被指数公式编译为向量化函数（只解析一次，作用于整列波段数据）。
+        Compile a vegetation index formula once into a vectorized function over whole band columns.
+        :param func_stri: Formula string from sets_data_func.json.
+        :return: IndexExpression
         """
-        list_wave = {float(wave_leng) for wave_leng in re.findall(r'@(\d+\.?\d*)', func_stri)}
-        replacements = {f'@{int(wave_leng)}': f"reflectance['{self.find_closest_band(wave_leng)}']"
-                        for wave_leng in list_wave}
-        stri_expr = func_stri
-        for stri_part, stri_repl in replacements.items():
-            stri_expr = stri_expr.replace(stri_part, stri_repl)
-        return lambda func_refl: eval(
-                stri_expr,
-                {'__builtins__': None},
-                {'reflectance': func_refl}
-                )
+        return VegetationIndexCompiler(self.find_closest_band).compile(func_stri)
 
-    def _init_reflectance_csv(self):
+    def _init_reflectance_csv(self, data_type=np.float64):
         """
-
+        以列式结构载入反射率数据：连续的波段矩阵、SPAD向量与ID索引。
+        首次解析CSV后在同目录写入 .npz 二进制缓存，CSV的大小或修改时间变化时缓存自动失效。
+        Load the reflectance table column-wise into a contiguous band matrix, a SPAD vector and an ID index.
+        After the first parse a binary .npz cache is written next to the CSV; it is invalidated whenever the size or
+        modification time of the CSV changes.
+        :param data_type: Floating point type of the band matrix and SPAD vector.
+        :return: ReflectanceColumnData
+        :raises FileNotFoundError: If the reflectance CSV does not exist.
         """
-        need_floa = {"SPAD"} | {f"Band_{numb_rows}" for numb_rows in range(1, 205)}
         refl_path = Path(self.data_path, self.refl_name)
         if not refl_path.exists():
             raise FileNotFoundError(f"反射率文件缺失：{refl_path}。")
-        with open(refl_path, "r") as refl_file:
-            data_read = csv.DictReader(refl_file)
-            refl_data = {}
-            for row in data_read:
-                conv_rows = {}
-                for band_keys, band_valu in row.items():
-                    if band_keys in need_floa:
-                        try:
-                            # 尝试将数值字段转换为浮点数
-                            conv_rows[band_keys] = float(band_valu)
-                        except ValueError:
-                            # 如果转换失败，记录警告日志并设置为 None
-                            self.root_logg.warning(
-                                    f"字段 {band_keys} 的值 {band_valu} 无法转换为浮点数，设置为 None"
-                                    )
-                            conv_rows[band_keys] = None
-                    else:
-                        # 非数值字段保持原始值
-                        conv_rows[band_keys] = band_valu
-                # 使用 ID 作为键存储转换后的行
-                refl_data[conv_rows["ID"]] = conv_rows
-
+        cach_path = refl_path.with_suffix(".npz")
+        stat_srce = refl_path.stat()
+        srce_sign = np.array([stat_srce.st_size, stat_srce.st_mtime_ns], dtype=np.int64)
+        # 缓存有效时直接载入二进制数组
+        if cach_path.exists():
+            try:
+                with np.load(cach_path, allow_pickle=False) as cach_data:
+                    if np.array_equal(cach_data["srce_sign"], srce_sign) and cach_data["band_matx"].dtype == data_type:
+                        self.root_logg.info(f"✅ 反射率数据已从缓存载入：{cach_path.name}")
+                        return ReflectanceColumnData(
+                                list(cach_data["band_name"]), cach_data["band_matx"], cach_data["spad_vect"],
+                                list(cach_data["sids_list"]), list(cach_data["time_list"])
+                                )
+            except (OSError, KeyError, ValueError) as e:
+                self.root_logg.warning(f"反射率缓存读取失败，重新解析CSV：{str(e)}")
+        band_name = [f"Band_{numb_rows}" for numb_rows in range(1, 205)]
+        colm_name = {"ID", "SPAD", "Time", *band_name}
+        data_fram = pd.read_csv(refl_path, usecols=lambda name: name in colm_name, dtype={"ID": str, "Time": str})
+        # 无法转换为浮点数的单元格记录警告并置为NaN
+        numb_fram = data_fram[["SPAD", *band_name]].apply(pd.to_numeric, errors="coerce")
+        bad_cell = numb_fram.isna() & data_fram[["SPAD", *band_name]].notna()
+        for band_keys in bad_cell.columns[bad_cell.any()]:
+            self.root_logg.warning(f"字段 {band_keys} 存在无法转换为浮点数的值，已设置为 NaN")
+        refl_data = ReflectanceColumnData(
+                band_name,
+                np.ascontiguousarray(numb_fram[band_name].to_numpy(dtype=data_type)),
+                numb_fram["SPAD"].to_numpy(dtype=data_type),
+                data_fram["ID"].str.strip().tolist(),
+                data_fram["Time"].fillna("").str.strip().tolist() if "Time" in data_fram else None
+                )
+        try:
+            np.savez(
+                    cach_path, srce_sign=srce_sign, band_name=np.array(refl_data.band_name),
+                    band_matx=refl_data.band_matx, spad_vect=refl_data.spad_vect, sids_list=np.array(refl_data.sids_list),
+                    time_list=np.array(refl_data.time_list or [], dtype=str)
+                    )
+        except OSError as e:
+            self.root_logg.warning(f"反射率缓存写入失败：{str(e)}")
         return refl_data
 
     def _init_fetch_formula_config(self):
@@ -487,46 +1074,256 @@ class DataPreprocessing:
         dict_func_sets = func_json["func_list"]
         return dict_func_sets
 
-    def create_data_splits(self, func_data):
-        dict_spli_data = {}
-        tran_lisx = []
-        tran_lisy = []
-        vali_lisx = []
-        vali_lisy = []
-        test_lisx = []
-        test_lisy = []
-        for tran_cunt in self.spli_dids["tran_sets"]:
-            tran_lisx.append([func_data[str(tran_cunt)]["comp_datx"], 1])
-            tran_lisy.append(func_data[str(tran_cunt)]["comp_daty"])
-        dict_spli_data["tran_sets"] = tran_lisx, tran_lisy
-        for vali_cunt in self.spli_dids["vali_sets"]:
-            vali_lisx.append([func_data[str(vali_cunt)]["comp_datx"], 1])
-            vali_lisy.append(func_data[str(vali_cunt)]["comp_daty"])
-        dict_spli_data["vali_sets"] = vali_lisx, vali_lisy
-        for test_cunt in self.spli_dids["test_sets"]:
-            test_lisx.append([func_data[str(test_cunt)]["comp_datx"], 1])
-            test_lisy.append(func_data[str(test_cunt)]["comp_daty"])
-        dict_spli_data["test_sets"] = test_lisx, test_lisy
+    def split_rows(self) -> Dict[str, np.ndarray]:
+        """
+        将划分中的样本ID转换为波段矩阵的行号数组（缺失的ID被忽略）。
+        Translate the sample IDs of each split into row numbers of the band matrix; unknown IDs are ignored.
+        """
+        return {
+            spli_name: np.array(
+                    [self.dict_refl.sids_indx[str(samp_sids)] for samp_sids in list_sids
+                     if str(samp_sids) in self.dict_refl.sids_indx], dtype=np.intp
+                    )
+            for spli_name, list_sids in self.spli_dids.items()
+            }
+
+    def create_data_splits(self, feat_matx: np.ndarray, targ_vect: np.ndarray) -> Dict[str, Any]:
+        """
+        按划分行号切出训练、验证、测试集，特征为连续的float32矩阵，目标为float64向量
+        （可直接交给XGBoost/LightGBM/CatBoost等模型，无需再由嵌套列表转换）。
+        另附全部样本的 full_sets，交叉验证按折行号直接索引该矩阵。
+        Slice the train/validation/test sets by row numbers. Features are contiguous float32 matrices and targets
+        float64 vectors, which the booster wrappers consume without converting nested Python lists. ``full_sets``
+        holds every row so cross-validation folds can index it directly.
+        """
+        dict_spli_data = {
+            "full_sets": (
+                np.ascontiguousarray(feat_matx, dtype=np.float32), np.asarray(targ_vect, dtype=np.float64)
+                )
+            }
+        for spli_name, rows_numb in self.split_rows().items():
+            dict_spli_data[spli_name] = (
+                np.ascontiguousarray(feat_matx[rows_numb], dtype=np.float32),
+                np.asarray(targ_vect[rows_numb], dtype=np.float64)
+                )
         return dict_spli_data
 
+    def build_fold_indices(self, fold_numb: int = 5, grup_freq: str = None) -> list:
+        """
+        预先计算K折交叉验证的行号数组（只计算一次，所有 指数 × 模型 任务共享）。
+        第k折作为测试集，第k+1折作为早停用的验证集，其余折为训练集。grup_freq 给定时（如 "D"、"h"）
+        按 Time 列取整后的时间段分组，同一时间段的样本总在同一折中；分组数少于折数时退回按样本划分。
+        Precompute the row index arrays of K-fold cross-validation once; they are shared by every index × model job.
+        Fold k is the test set, fold k+1 the validation set used for early stopping and the rest the training set.
+        With grup_freq (e.g. "D", "h") samples are grouped by their Time column floored to that period and a group
+        never spans two folds; with fewer groups than folds the split falls back to individual samples.
+        :param fold_numb: Number of folds (>= 3).
+        :param grup_freq: Optional pandas frequency used to group samples by sampling time.
+        :return: List of {"tran_sets"/"vali_sets"/"test_sets": row index array} per fold.
+        :raises ValueError: If fold_numb < 3 or there are fewer samples than folds.
+        """
+        cach_keys = (fold_numb, grup_freq)
+        if cach_keys in self.fold_cach:
+            return self.fold_cach[cach_keys]
+        samp_numb = len(self.dict_refl)
+        if fold_numb < 3 or samp_numb < fold_numb:
+            self.root_logg.error(f"❌ 折数 {fold_numb} 无效（需 >= 3 且不超过样本数 {samp_numb}）")
+            raise ValueError(f"❌ 折数 {fold_numb} 无效（需 >= 3 且不超过样本数 {samp_numb}）")
+        rand_objt = np.random.default_rng(self.seed_numb)
+        grup_labl = None
+        if grup_freq:
+            if self.dict_refl.time_list is None:
+                self.root_logg.warning("❕ 数据表缺少 Time 列，改为按样本划分交叉验证折")
+            else:
+                time_seri = pd.to_datetime(pd.Series(self.dict_refl.time_list), errors="coerce").dt.floor(grup_freq)
+                grup_labl = pd.factorize(time_seri, use_na_sentinel=False)[0]
+                if grup_labl.max() + 1 < fold_numb:
+                    self.root_logg.warning(
+                            f"❕ 按 {grup_freq} 分组只有 {grup_labl.max() + 1} 组，少于折数 {fold_numb}，改为按样本划分"
+                            )
+                    grup_labl = None
+        if grup_labl is None:
+            fold_labl = np.empty(samp_numb, dtype=np.intp)
+            fold_labl[rand_objt.permutation(samp_numb)] = np.arange(samp_numb) % fold_numb
+        else:
+            # 打乱后按组大小从大到小依次放入当前样本最少的折，使各折样本数接近
+            grup_size = np.bincount(grup_labl)
+            grup_ordr = rand_objt.permutation(len(grup_size))
+            grup_ordr = grup_ordr[np.argsort(-grup_size[grup_ordr], kind="stable")]
+            fold_size = np.zeros(fold_numb, dtype=np.intp)
+            grup_fold = np.empty(len(grup_size), dtype=np.intp)
+            for grup_indx in grup_ordr:
+                grup_fold[grup_indx] = np.argmin(fold_size)
+                fold_size[grup_fold[grup_indx]] += grup_size[grup_indx]
+            fold_labl = grup_fold[grup_labl]
+        list_fold = []
+        for fold_indx in range(fold_numb):
+            vali_indx = (fold_indx + 1) % fold_numb
+            list_fold.append({
+                "tran_sets": np.flatnonzero((fold_labl != fold_indx) & (fold_labl != vali_indx)),
+                "vali_sets": np.flatnonzero(fold_labl == vali_indx),
+                "test_sets": np.flatnonzero(fold_labl == fold_indx)
+                })
+        self.fold_cach[cach_keys] = list_fold
+        return list_fold
+
     def compute_singel_vegetation_indices(self, func_name):
         stri_func = self.func_data[func_name]
         func_objt = self.create_index_function(stri_func)
-        keyw_data = {}
-        for coun_grop in range(1, 241):
-            sign_refl = self.dict_refl[str(coun_grop)]
-            func_rezu = func_objt(sign_refl)
-            comp_daty = sign_refl["SPAD"]
-            keyw_data[str(coun_grop)] = {
-                "comp_datx": func_rezu,
-                "comp_daty": comp_daty
+        # 一次向量化计算全部样本的植被指数
+        indx_vect = func_objt(self.dict_refl.band_column)
+        if np.isnan(indx_vect).any():
+            self.root_logg.warning(f"❕ 植被指数 {func_name} 存在 {int(np.isnan(indx_vect).sum())} 个无效值（分母为0或缺失数据）")
+        # 特征为 [指数值, 1]
+        feat_matx = np.column_stack([indx_vect, np.ones_like(indx_vect)])
+        spli_data = self.create_data_splits(feat_matx, self.dict_refl.spad_vect)
+        spli_data["feat_meta"] = {
+            "feat_mode": "index", "feat_name": func_name, "func_name": func_name, "func_stri": stri_func,
+            "wave_band": func_objt.wave_band
+            }
+        return spli_data
+
+    def select_ranked_bands(self, rows_tran: np.ndarray) -> np.ndarray:
+        """
+        按训练集上与SPAD的相关性排名（p值升序、|r|降序，同 mode_CORR_Anal 的排序规则）选出前 band_topk 个波段。
+        Pick the band_topk bands ranked by their correlation with SPAD on the training rows (ascending p-value, then
+        descending |r|, the ordering used in mode_CORR_Anal).
+        :param rows_tran: Row numbers of the training split.
+        :return: Column indices of the selected bands.
+        """
+        return self.rank_bands(self.dict_refl.band_matx[rows_tran], self.dict_refl.spad_vect[rows_tran], self.band_topk)
+
+    @staticmethod
+    def rank_bands(band_matx: np.ndarray, spad_vect: np.ndarray, band_topk: int) -> np.ndarray:
+        """按与SPAD的相关性排名（p值升序、|r|降序）返回前 band_topk 个波段的列号（升序）"""
+        from mode_CORR_Anal import BatchCorrelationEngine
+
+        corr_vect, varp_vect = BatchCorrelationEngine().pearson(band_matx, spad_vect)
+        # NaN（常数波段）排在最后
+        rank_indx = np.lexsort((-np.nan_to_num(np.abs(corr_vect)), np.nan_to_num(varp_vect, nan=np.inf)))
+        return np.sort(rank_indx[:band_topk])
+
+    @staticmethod
+    def fit_reducer(redu_mode: str, comp_numb: int, x_train: np.ndarray, y_train: np.ndarray):
+        """
+        在训练集上拟合PCA/PLS降维对象（成分数不超过特征数与样本数）。
+        :raises ValueError: 降维方式不受支持时抛出。
+        """
+        comp_numb = min(comp_numb, x_train.shape[1], x_train.shape[0])
+        if redu_mode == "pca":
+            from sklearn.decomposition import PCA
+            return PCA(n_components=comp_numb).fit(x_train)
+        if redu_mode == "pls":
+            from sklearn.cross_decomposition import PLSRegression
+            return PLSRegression(n_components=comp_numb).fit(x_train, y_train)
+        raise ValueError(f"❌ 不支持的降维方式：{redu_mode}")
+
+    @staticmethod
+    def fold_features(full_sets: tuple, fold_rows: Dict[str, np.ndarray], feat_conf: Dict[str, Any] = None
+                      ) -> Dict[str, tuple]:
+        """
+        取出交叉验证某一折的训练、验证、测试集。feat_conf 给定时（"ranked" 波段筛选或 PCA/PLS 降维），
+        full_sets 为全部波段，波段排名与降维只在该折训练集上拟合，再作用于该折的验证集与测试集，测试折不参与任何拟合。
+        Gather one cross-validation fold. With feat_conf (ranked band selection or PCA/PLS), full_sets holds every
+        band and the ranking and the reducer are fit on this fold's training rows only, then applied to its
+        validation and test rows, so the test fold never takes part in any fit.
+        :param full_sets: (features, targets) of every sample; may be a read-only memory map.
+        :param fold_rows: {"tran_sets"/"vali_sets"/"test_sets": row index array} of this fold.
+        :param feat_conf: {"feat_mode", "band_topk", "redu_mode", "comp_numb"}, or None to use the columns as-is.
+        :return: {split name: (float32 feature matrix, float64 target vector)}.
+        """
+        feat_matx, targ_vect = full_sets
+        colm_indx = np.arange(feat_matx.shape[1])
+        if feat_conf and feat_conf["feat_mode"] == "ranked":
+            rows_tran = fold_rows["tran_sets"]
+            colm_indx = DataPreprocessing.rank_bands(
+                    feat_matx[rows_tran], targ_vect[rows_tran], feat_conf["band_topk"]
+                    )
+        # 行号不连续，按行取出本折数据（模型需要连续的训练矩阵）
+        dict_spli = {
+            spli_name: (
+                np.ascontiguousarray(feat_matx[np.ix_(rows_numb, colm_indx)], dtype=np.float32),
+                np.asarray(targ_vect[rows_numb], dtype=np.float64)
+                )
+            for spli_name, rows_numb in fold_rows.items()
+            }
+        if feat_conf and feat_conf["redu_mode"]:
+            redu_objt = DataPreprocessing.fit_reducer(
+                    feat_conf["redu_mode"], feat_conf["comp_numb"], *dict_spli["tran_sets"]
+                    )
+            dict_spli = {
+                spli_name: (np.ascontiguousarray(redu_objt.transform(x_spli), dtype=np.float32), y_spli)
+                for spli_name, (x_spli, y_spli) in dict_spli.items()
                 }
-        spli_data = self.create_data_splits(keyw_data)
-        # spli_data = keyw_data
+        return dict_spli
+
+    def reduce_dimensions(self, spli_data: Dict[str, Any], band_indx: np.ndarray) -> Dict[str, Any]:
+        """
+        在训练集上拟合PCA/PLS降维并变换全部划分；结果按（降维方式, 成分数, 波段集合）缓存，同一划分只拟合一次。
+        Fit PCA/PLS on the training split and transform every split. Results are cached per (method, components,
+        band set) so each split is reduced only once.
+        """
+        cach_keys = (self.redu_mode, self.comp_numb, tuple(band_indx.tolist()))
+        if cach_keys in self.redu_cach:
+            return self.redu_cach[cach_keys]
+        x_train, y_train = spli_data["tran_sets"]
+        comp_numb = min(self.comp_numb, x_train.shape[1], x_train.shape[0])
+        try:
+            redu_objt = self.fit_reducer(self.redu_mode, comp_numb, x_train, y_train)
+        except ValueError:
+            self.root_logg.error(f"❌ 不支持的降维方式：{self.redu_mode}")
+            raise
+        redu_data = {}
+        for spli_name, spli_valu in spli_data.items():
+            if spli_name == "feat_meta":
+                continue
+            feat_matx, targ_vect = spli_valu
+            redu_data[spli_name] = (
+                np.ascontiguousarray(redu_objt.transform(feat_matx), dtype=np.float32), targ_vect
+                )
+        redu_data["feat_meta"] = {**spli_data["feat_meta"], "redu_mode": self.redu_mode, "comp_numb": comp_numb}
+        redu_data["redu_objt"] = redu_objt
+        self.redu_cach[cach_keys] = redu_data
+        self.root_logg.info(f"✅ {self.redu_mode.upper()} 降维完成：{x_train.shape[1]} → {comp_numb} 维")
+        return redu_data
+
+    def compute_spectrum_features(self):
+        """
+        构建全光谱（feat_mode="spectrum"）或相关性排名波段子集（feat_mode="ranked"）特征矩阵，可选PCA/PLS降维。
+        Build the full-spectrum (feat_mode="spectrum") or correlation-ranked band subset (feat_mode="ranked") feature
+        matrix, optionally reduced with PCA/PLS.
+        """
+        band_matx = self.dict_refl.band_matx
+        if self.feat_mode == "ranked":
+            band_indx = self.select_ranked_bands(self.split_rows()["tran_sets"])
+        else:
+            band_indx = np.arange(band_matx.shape[1])
+        spli_data = self.create_data_splits(band_matx[:, band_indx], self.dict_refl.spad_vect)
+        spli_data["feat_meta"] = {
+            "feat_mode": self.feat_mode,
+            "feat_name": self.spectrum_feature_name(),
+            "band_list": [self.dict_refl.band_name[numb] for numb in band_indx]
+            }
+        self.root_logg.info(f"✅ 光谱特征矩阵：{len(band_indx)} 个波段（{self.feat_mode}）")
+        if self.redu_mode:
+            spli_data = self.reduce_dimensions(spli_data, band_indx)
         return spli_data
 
+    def spectrum_feature_name(self) -> str:
+        """
+        光谱特征集名称（run() 返回字典的键，也用于检查点文件名），如 full_spectrum、ranked_top20_pca5。
+        Name of the spectral feature set: the key returned by run() and used in checkpoint file names.
+        """
+        name_feat = "full_spectrum" if self.feat_mode == "spectrum" else f"ranked_top{self.band_topk}"
+        if self.redu_mode:
+            name_feat = f"{name_feat}_{self.redu_mode}{self.comp_numb}"
+        return name_feat
+
     def run(self):
         dict_spli_data = {}
+        if self.feat_mode in ("spectrum", "ranked"):
+            dict_spli_data[self.spectrum_feature_name()] = self.compute_spectrum_features()
+            return dict_spli_data
         for func_name in self.func_data.keys():
             func_data = self.compute_singel_vegetation_indices(func_name)
             dict_spli_data[func_name] = func_data
@@ -2,12 +2,20 @@ import glob
 import logging
 import os
 import re
+import time
 import warnings
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import islice, repeat
 
+import cv2
 import numpy as np
 import pandas as pd
 import rasterio
 from rasterio.errors import NotGeoreferencedWarning
+from rasterio.windows import Window
+
+from run_manifest import RunManifest
 
 # 获取全局logger
 logger = logging.getLogger("app_logger")
@@ -37,78 +45,524 @@ def read_coordinates(coord_csv, min_points, image_id):
         return None
 
 
-def process_reflectance(dat_path, coordinates_df, output_csv, image_id):
-    """处理单个图像ID的反射率数据"""
+def group_point_windows(coordinate_indices, window_size=256):
+    """按固定网格将相邻坐标点合并到共享窗口，返回[(窗口, 点序号数组), ...]"""
+    grid_keys = coordinate_indices // window_size
+    # 按网格单元排序后分段，同一单元内的点共用一个读取窗口
+    order = np.lexsort((grid_keys[:, 1], grid_keys[:, 0]))
+    sorted_keys = grid_keys[order]
+    split_at = np.flatnonzero((np.diff(sorted_keys, axis=0) != 0).any(axis=1)) + 1
+
+    windows = []
+    for members in np.split(order, split_at):
+        rows = coordinate_indices[members, 0]
+        cols = coordinate_indices[members, 1]
+        # 只读取覆盖组内所有点的最小矩形
+        row_off, col_off = rows.min(), cols.min()
+        window = Window(col_off, row_off, cols.max() - col_off + 1, rows.max() - row_off + 1)
+        windows.append((window, members))
+    return windows
+
+
+def read_point_spectra(src, coordinate_indices, window_size=256):
+    """仅读取包含坐标点的窗口，返回形状为(点数, 波段数)的反射率矩阵"""
+    reflectance_data = np.empty((len(coordinate_indices), src.count), dtype=src.dtypes[0])
+    for window, members in group_point_windows(coordinate_indices, window_size):
+        block = src.read(window=window)
+        rows = coordinate_indices[members, 0] - window.row_off
+        cols = coordinate_indices[members, 1] - window.col_off
+        reflectance_data[members] = block[:, rows, cols].T
+    return reflectance_data
+
+
+# ENVI头文件 data type 编码与numpy类型的对应关系
+ENVI_DTYPES = {
+    1: np.uint8,
+    2: np.int16,
+    3: np.int32,
+    4: np.float32,
+    5: np.float64,
+    12: np.uint16,
+    13: np.uint32,
+    14: np.int64,
+    15: np.uint64
+    }
+
+
+def find_envi_header(dat_path):
+    """查找.dat文件对应的.hdr头文件（支持 name.hdr 与 name.dat.hdr 两种命名）"""
+    for hdr_path in (os.path.splitext(dat_path)[0] + ".hdr", dat_path + ".hdr"):
+        if os.path.exists(hdr_path):
+            return hdr_path
+    return None
+
+
+def parse_envi_header(hdr_path):
+    """解析ENVI头文件，返回小写键名的字典（花括号内的多行值会被合并）"""
+    with open(hdr_path, "r", encoding="utf-8", errors="ignore") as hdr_file:
+        lines = hdr_file.read().splitlines()
+    if not lines or lines[0].strip() != "ENVI":
+        raise ValueError(f"不是有效的ENVI头文件：{hdr_path}")
+
+    header = {}
+    key, buffer = None, None
+    for line in lines[1:]:
+        if buffer is not None:
+            buffer.append(line)
+            if "}" in line:
+                header[key] = " ".join(buffer).strip()
+                key, buffer = None, None
+            continue
+        if "=" not in line:
+            continue
+        key, value = (part.strip() for part in line.split("=", 1))
+        key = key.lower()
+        if value.startswith("{") and "}" not in value:
+            buffer = [value]
+        else:
+            header[key] = value
+    return header
+
+
+def open_envi_memmap(dat_path):
+    """按ENVI头文件将数据立方体映射为只读numpy.memmap，返回(立方体, 交织方式)"""
+    hdr_path = find_envi_header(dat_path)
+    if hdr_path is None:
+        raise FileNotFoundError(f"未找到头文件：{os.path.basename(dat_path)}")
+    header = parse_envi_header(hdr_path)
+
+    samples, lines, bands = (int(header[k]) for k in ("samples", "lines", "bands"))
+    data_type = int(header["data type"])
+    if data_type not in ENVI_DTYPES:
+        raise ValueError(f"不支持的ENVI数据类型：{data_type}")
+    dtype = np.dtype(ENVI_DTYPES[data_type]).newbyteorder(">" if header.get("byte order", "0") == "1" else "<")
+    interleave = header.get("interleave", "bsq").lower()
+    shape = {
+        "bsq": (bands, lines, samples),
+        "bil": (lines, bands, samples),
+        "bip": (lines, samples, bands)
+        }
+    if interleave not in shape:
+        raise ValueError(f"不支持的交织方式：{interleave}")
+
+    cube = np.memmap(
+            dat_path, dtype=dtype, mode="r", offset=int(header.get("header offset", 0)), shape=shape[interleave]
+            )
+    return cube, interleave
+
+
+def read_point_spectra_memmap(cube, interleave, coordinate_indices):
+    """从内存映射立方体中直接索引坐标点光谱，返回形状为(点数, 波段数)的矩阵"""
+    rows, cols = coordinate_indices[:, 0], coordinate_indices[:, 1]
+    if interleave == "bip":
+        # 每个像元的光谱在文件中连续存放
+        reflectance_data = cube[rows, cols, :]
+    elif interleave == "bil":
+        reflectance_data = cube[rows, :, cols]
+    else:
+        # BSQ按行优先顺序访问，使每个波段平面内的读取单调向前
+        order = np.lexsort((cols, rows))
+        reflectance_data = np.empty((len(rows), cube.shape[0]), dtype=cube.dtype)
+        reflectance_data[order] = cube[:, rows[order], cols[order]].T
+    return reflectance_data.astype(cube.dtype.newbyteorder("="), copy=False)
+
+
+def sample_rasterio(dat_path, coordinate_indices, image_id, window_size=256):
+    """通过rasterio窗口读取坐标点光谱，越界时返回None"""
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore", category=NotGeoreferencedWarning)
+        with rasterio.open(dat_path) as src:
+            logger.info(f"成功打开文件 {dat_path}")
+            if not src.transform or src.transform == rasterio.Affine.identity():
+                logger.warning(f"警告❕ 文件缺少地理参考信息")
+
+            # 边界检查
+            if (coordinate_indices < 0).any() or (coordinate_indices >= [src.height, src.width]).any():
+                logger.error(f"错误：{image_id} 存在越界坐标")
+                return None
+
+            # 按窗口稀疏读取反射率（避免载入整幅数据立方体）
+            return read_point_spectra(src, coordinate_indices, window_size)
+
+
+def sample_memmap(dat_path, coordinate_indices, image_id):
+    """通过ENVI内存映射读取坐标点光谱（不经过GDAL），越界时返回None"""
+    cube, interleave = open_envi_memmap(dat_path)
+    logger.info(f"成功映射文件 {dat_path}（{interleave.upper()}）")
+    # 不同交织方式下行、列所在的轴
+    row_axis, col_axis = {"bsq": (1, 2), "bil": (0, 2), "bip": (0, 1)}[interleave]
+    height, width = cube.shape[row_axis], cube.shape[col_axis]
+
+    # 边界检查
+    if (coordinate_indices < 0).any() or (coordinate_indices >= [height, width]).any():
+        logger.error(f"错误：{image_id} 存在越界坐标")
+        return None
+
+    return read_point_spectra_memmap(cube, interleave, coordinate_indices)
+
+
+def read_label_image(label_png, height, width):
+    """
+    读取image_tag保存的区域标签图并对齐到数据立方体：坐标点(X, Y)对应立方体像元(Y-1, X-1)，
+    故标签图整体偏移一个像元，超出部分裁去、不足部分补0（背景）。
+    """
+    label_img = cv2.imread(label_png, cv2.IMREAD_UNCHANGED)
+    if label_img is None:
+        raise OSError(f"无法读取标签图：{label_png}")
+    labels = np.zeros((height, width), dtype=np.int64)
+    shifted = label_img[1:height + 1, 1:width + 1]
+    labels[:shifted.shape[0], :shifted.shape[1]] = shifted
+    return labels
+
+
+def iter_cube_blocks(dat_path, backend, row_range, col_range, block_rows=64):
+    """按行块顺序读取数据立方体的矩形范围，逐块返回 (起始行, (波段, 行, 列) 数组)"""
+    (row_start, row_stop), (col_start, col_stop) = row_range, col_range
+    if backend == "memmap":
+        cube, interleave = open_envi_memmap(dat_path)
+        for row_off in range(row_start, row_stop, block_rows):
+            row_end = min(row_off + block_rows, row_stop)
+            if interleave == "bsq":
+                block = cube[:, row_off:row_end, col_start:col_stop]
+            elif interleave == "bil":
+                block = cube[row_off:row_end, :, col_start:col_stop].transpose(1, 0, 2)
+            else:
+                block = cube[row_off:row_end, col_start:col_stop, :].transpose(2, 0, 1)
+            yield row_off, block
+        return
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore", category=NotGeoreferencedWarning)
+        with rasterio.open(dat_path) as src:
+            for row_off in range(row_start, row_stop, block_rows):
+                row_end = min(row_off + block_rows, row_stop)
+                yield row_off, src.read(window=Window(col_start, row_off, col_stop - col_start, row_end - row_off))
+
+
+def cube_shape(dat_path, backend):
+    """返回数据立方体的 (行数, 列数)"""
+    if backend == "memmap":
+        cube, interleave = open_envi_memmap(dat_path)
+        row_axis, col_axis = {"bsq": (1, 2), "bil": (0, 2), "bip": (0, 1)}[interleave]
+        return cube.shape[row_axis], cube.shape[col_axis]
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore", category=NotGeoreferencedWarning)
+        with rasterio.open(dat_path) as src:
+            return src.height, src.width
+
+
+def summarize_regions(region_ids, values, stats):
+    """
+    对已读取全部像元的区域按标签分段归约：均值与标准差（总体标准差）用 np.add.reduceat，
+    中位数在按标签排序后的缓冲区上逐段原地部分排序（np.partition）取中间位置；结果写入stats中对应区域的行。
+    """
+    order = np.argsort(region_ids, kind="stable")
+    region_ids, values = region_ids[order], values[:, order]
+    starts = np.flatnonzero(np.concatenate([[True], np.diff(region_ids) != 0]))
+    counts = np.diff(np.append(starts, len(region_ids)))
+    ids = region_ids[starts]
+
+    mean = np.add.reduceat(values, starts, axis=1) / counts
+    deviation = values - np.repeat(mean, counts, axis=1)
+    stats["std"][ids] = np.sqrt(np.add.reduceat(deviation * deviation, starts, axis=1) / counts).T
+    stats["mean"][ids] = mean.T
+
+    # 各区域像元在缓冲区中连续，段内部分排序比整体排序快一个数量级（缓冲区此后不再使用，可原地修改）
+    for region_id, start, count in zip(ids, starts, counts):
+        segment = values[:, start:start + count]
+        lower, upper = (count - 1) // 2, count // 2
+        segment.partition([lower, upper] if lower != upper else lower, axis=1)
+        stats["median"][region_id] = (segment[:, lower] + segment[:, upper]) / 2
+    stats["pixels"][ids] = counts
+
+
+def region_spectra(dat_path, labels, backend="rasterio", block_rows=64):
+    """
+    单次顺序读取数据立方体，计算每个标签区域全部波段的均值、中位数与标准差光谱。
+    只读取包含标签像元的外接矩形；每块中仅保留尚未读完的区域像元，区域最后一行读完后立即归约并释放。
+    返回 {"mean"/"median"/"std": (最大ID+1, 波段数) 数组, "pixels": 像元数}，无像元的区域为NaN。
+    """
+    rows, cols = np.nonzero(labels)
+    max_id = int(labels.max())
+    if max_id == 0:
+        raise ValueError("标签图中没有区域像元")
+    # 每个区域最后出现的行
+    last_row = np.full(max_id + 1, -1, dtype=np.int64)
+    np.maximum.at(last_row, labels[rows, cols], rows)
+
+    stats = {}
+    pending_ids, pending_values = [], []
+    for row_off, block in iter_cube_blocks(
+            dat_path, backend, (rows.min(), rows.max() + 1), (cols.min(), cols.max() + 1), block_rows
+            ):
+        if not stats:
+            stats = {name: np.full((max_id + 1, block.shape[0]), np.nan) for name in ("mean", "median", "std")}
+            stats["pixels"] = np.zeros(max_id + 1, dtype=np.int64)
+        block_labels = labels[row_off:row_off + block.shape[1], cols.min():cols.max() + 1]
+        block_rows_idx, block_cols_idx = np.nonzero(block_labels)
+        pending_ids.append(block_labels[block_rows_idx, block_cols_idx])
+        pending_values.append(block[:, block_rows_idx, block_cols_idx].astype(np.float64))
+
+        # 最后一行已读完的区域归约，其余像元留待后续块
+        region_ids, values = np.concatenate(pending_ids), np.concatenate(pending_values, axis=1)
+        finished = last_row[region_ids] < row_off + block.shape[1]
+        if finished.any():
+            summarize_regions(region_ids[finished], values[:, finished], stats)
+        pending_ids, pending_values = [region_ids[~finished]], [values[:, ~finished]]
+    return stats
+
+
+def extract_region_reflectance(dat_path, coordinates_df, label_png, image_id, backend="rasterio", block_rows=64):
+    """按区域标签图统计反射率，返回 {"mean"/"median"/"std": 结果DataFrame}（列与逐点结果一致），失败时返回None"""
+    try:
+        labels = read_label_image(label_png, *cube_shape(dat_path, backend))
+    except Exception as e:
+        logger.error(f"处理{image_id}失败：{str(e)}")
+        return None
+    return region_reflectance(dat_path, coordinates_df, labels, image_id, backend, block_rows)
+
+
+def region_reflectance(dat_path, coordinates_df, labels, image_id, backend="rasterio", block_rows=64):
+    """按已对齐到数据立方体的标签数组统计反射率，返回 {"mean"/"median"/"std": 结果DataFrame}，失败时返回None"""
     try:
-        with warnings.catch_warnings():
-            warnings.filterwarnings("ignore", category=NotGeoreferencedWarning)
-            with rasterio.open(dat_path) as src:
-                logger.info(f"成功打开文件 {dat_path}")
-                if not src.transform or src.transform == rasterio.Affine.identity():
-                    logger.warning(f"警告❕ 文件缺少地理参考信息")
-
-                # 转换坐标索引
-                coordinate_indices = np.array(
-                        [(y - 1, x - 1) for x, y in coordinates_df[["X", "Y"]].values], dtype=int
-                        )
-
-                # 边界检查
-                if (coordinate_indices >= [src.height, src.width]).any():
-                    logger.error(f"错误：{image_id} 存在越界坐标")
-                    return False
-
-                # 批量读取反射率
-                reflectance_data = src.read()[:, coordinate_indices[:, 0], coordinate_indices[:, 1]].T
-
-                # 构建结果DataFrame
-                columns = ["ID", "X", "Y"] + [f"Band_{i + 1}" for i in range(reflectance_data.shape[1])]
-                reflectance_results = pd.DataFrame(
-                        np.column_stack([coordinates_df[["ID", "X", "Y"]].values, reflectance_data]),
-                        columns=columns
-                        )
-
-                # 保存结果
-                reflectance_results.to_csv(output_csv, index=False)
-                logger.info(
-                    "\n" + "=" * 20 + f"\n成功处理：{image_id}\n输出文件：{os.path.relpath(output_csv)}\n包含数据："
-                                      f"{len(reflectance_results)}条记录" + "\n" + "=" * 20
+        start_time = time.time()
+        stats = region_spectra(dat_path, labels, backend, block_rows)
+        ids = coordinates_df["ID"].to_numpy(dtype=np.int64)
+        known = (ids > 0) & (ids < len(stats["pixels"]))
+        empty = np.flatnonzero(~known | (stats["pixels"][np.where(known, ids, 0)] == 0))
+        if len(empty):
+            logger.warning(f"{image_id} 有 {len(empty)} 个点在数据立方体中没有区域像元，统计值为NaN")
+        logger.info(f"{image_id} 区域反射率统计完成，耗时：{time.time() - start_time:.2f}秒")
+
+        band_count = stats["mean"].shape[1]
+        columns = ["ID", "X", "Y"] + [f"Band_{i + 1}" for i in range(band_count)]
+        results = {}
+        for name in ("mean", "median", "std"):
+            spectra = np.full((len(ids), band_count), np.nan)
+            spectra[known] = stats[name][ids[known]]
+            results[name] = pd.DataFrame(
+                    np.column_stack([coordinates_df[["ID", "X", "Y"]].values, spectra]), columns=columns
                     )
-                return True
+        return results
     except Exception as e:
         logger.error(f"处理{image_id}失败：{str(e)}")
+        return None
+
+
+def extract_reflectance(dat_path, coordinates_df, image_id, window_size=256, backend="rasterio"):
+    """读取坐标点反射率并构建结果DataFrame（backend可选 "rasterio" 或 "memmap"），失败时返回None"""
+    try:
+        # 转换坐标索引
+        coordinate_indices = np.array(
+                [(y - 1, x - 1) for x, y in coordinates_df[["X", "Y"]].values], dtype=int
+                ).reshape(-1, 2)
+
+        start_time = time.time()
+        if backend == "memmap":
+            reflectance_data = sample_memmap(dat_path, coordinate_indices, image_id)
+        else:
+            reflectance_data = sample_rasterio(dat_path, coordinate_indices, image_id, window_size)
+        if reflectance_data is None:
+            return None
+        logger.info(f"{image_id} 反射率读取完成，耗时：{time.time() - start_time:.2f}秒")
+
+        # 构建结果DataFrame
+        columns = ["ID", "X", "Y"] + [f"Band_{i + 1}" for i in range(reflectance_data.shape[1])]
+        return pd.DataFrame(
+                np.column_stack([coordinates_df[["ID", "X", "Y"]].values, reflectance_data]),
+                columns=columns
+                )
+    except Exception as e:
+        logger.error(f"处理{image_id}失败：{str(e)}")
+        return None
+
+
+def region_output_paths(output_csv):
+    """按区域统计时各统计量的输出路径：均值沿用逐点结果的文件名，中位数与标准差另加后缀"""
+    stem, ext = os.path.splitext(output_csv)
+    return {"mean": output_csv, "median": f"{stem}_median{ext}", "std": f"{stem}_std{ext}"}
+
+
+def save_reflectance(reflectance_results, output_csv, image_id):
+    """保存单个图像ID的反射率结果（按区域统计时为 {统计量: DataFrame}，分别写出）"""
+    try:
+        if isinstance(reflectance_results, dict):
+            for name, output_path in region_output_paths(output_csv).items():
+                reflectance_results[name].to_csv(output_path, index=False)
+            reflectance_results = reflectance_results["mean"]
+        else:
+            reflectance_results.to_csv(output_csv, index=False)
+        logger.info(
+            "\n" + "=" * 20 + f"\n成功处理：{image_id}\n输出文件：{os.path.relpath(output_csv)}\n包含数据："
+                              f"{len(reflectance_results)}条记录" + "\n" + "=" * 20
+            )
+        return True
+    except Exception as e:
+        logger.error(f"保存{image_id}结果失败：{str(e)}")
         return False
 
 
-def process_data(image_id, output_base=".\\results", min_points=59):
-    """处理单个图像ID对应的dat文件和坐标数据"""
-    # 路径配置
+def process_reflectance(dat_path, coordinates_df, output_csv, image_id, window_size=256, backend="rasterio"):
+    """处理单个图像ID的反射率数据"""
+    reflectance_results = extract_reflectance(dat_path, coordinates_df, image_id, window_size, backend)
+    if reflectance_results is None:
+        return False
+    return save_reflectance(reflectance_results, output_csv, image_id)
+
+
+def reflectance_paths(image_id, output_base=".\\results"):
+    """返回单个图像ID的.dat文件、坐标文件与输出文件路径"""
     dat_path = os.path.join(".\\meta_data", image_id, f"results\\REFLECTANCE_{image_id}.dat")
     coord_csv = os.path.join(output_base, image_id, f"{image_id}_points.csv")
     output_csv = os.path.join(output_base, image_id, f"reflectance_{image_id}.csv")
+    return dat_path, coord_csv, output_csv
+
+
+def label_path(image_id, output_base=".\\results"):
+    """返回image_tag保存的区域标签图路径（TAG_PARAMS["save_labels"]开启时生成）"""
+    return os.path.join(output_base, image_id, f"{image_id}_labels.png")
+
+
+def reflectance_cache_spec(image_id, output_base=".\\results", min_points=59, sampling="point"):
+    """返回处理清单所需的输入文件、输出文件与参数"""
+    dat_path, coord_csv, output_csv = reflectance_paths(image_id, output_base)
+    inputs = [dat_path, coord_csv]
+    hdr_path = find_envi_header(dat_path)
+    if hdr_path is not None:
+        inputs.append(hdr_path)
+    outputs = [output_csv]
+    if sampling == "region":
+        inputs.append(label_path(image_id, output_base))
+        outputs = list(region_output_paths(output_csv).values())
+    return inputs, outputs, {"min_points": min_points, "sampling": sampling}
+
+
+def is_reflectance_fresh(image_id, manifest, output_base=".\\results", min_points=59, sampling="point"):
+    """判断单个图像ID的反射率结果是否与处理清单一致"""
+    inputs, outputs, params = reflectance_cache_spec(image_id, output_base, min_points, sampling)
+    if not all(os.path.exists(file_path) for file_path in inputs):
+        return False
+    return manifest.is_fresh("obtain_reflectance", image_id, inputs, outputs, params)
+
+
+def record_reflectance(image_id, manifest, output_base=".\\results", min_points=59, sampling="point"):
+    """将成功处理的图像ID写入处理清单"""
+    inputs, outputs, params = reflectance_cache_spec(image_id, output_base, min_points, sampling)
+    manifest.record("obtain_reflectance", image_id, inputs, outputs, params)
+
+
+def load_data(image_id, output_base=".\\results", min_points=59, backend="rasterio", sampling="point"):
+    """
+    读取单个图像ID的坐标与反射率，返回(输出路径, 结果)，无法处理时返回None。
+    sampling为 "point" 时取每个中心点的单像元光谱（结果为DataFrame）；
+    为 "region" 时按区域标签图统计均值、中位数与标准差光谱（结果为 {统计量: DataFrame}）。
+    """
+    # 路径配置
+    dat_path, coord_csv, output_csv = reflectance_paths(image_id, output_base)
 
     # 验证文件存在性
     if not validate_files(dat_path, coord_csv, image_id):
-        return
+        return None
+    if sampling == "region" and not os.path.exists(label_path(image_id, output_base)):
+        logger.warning(f"跳过 {image_id}: 未找到区域标签图（需在image_tag中开启save_labels）")
+        return None
 
     # 读取坐标数据
     coordinates_df = read_coordinates(coord_csv, min_points, image_id)
     if coordinates_df is None:
-        return
+        return None
+
+    # 读取反射率数据
+    if sampling == "region":
+        reflectance_results = extract_region_reflectance(
+                dat_path, coordinates_df, label_path(image_id, output_base), image_id, backend=backend
+                )
+    else:
+        reflectance_results = extract_reflectance(dat_path, coordinates_df, image_id, backend=backend)
+    if reflectance_results is None:
+        return None
+    return output_csv, reflectance_results
+
 
-    # 处理反射率数据
-    process_reflectance(dat_path, coordinates_df, output_csv, image_id)
+def process_data(image_id, output_base=".\\results", min_points=59, backend="rasterio", manifest=None,
+                 sampling="point"):
+    """处理单个图像ID对应的dat文件和坐标数据；传入manifest时跳过未变化的ID并记录新结果"""
+    if manifest is not None and is_reflectance_fresh(image_id, manifest, output_base, min_points, sampling):
+        logger.info(f"{image_id} 输入与参数未发生变化，沿用已有反射率结果")
+        return True
+    loaded = load_data(image_id, output_base, min_points, backend, sampling)
+    if loaded is None:
+        return False
+    output_csv, reflectance_results = loaded
+    succeeded = save_reflectance(reflectance_results, output_csv, image_id)
+    if succeeded and manifest is not None:
+        record_reflectance(image_id, manifest, output_base, min_points, sampling)
+    return succeeded
 
 
-def batch_process():
-    """批量处理所有有效图像ID"""
-    # 自动发现所有可能存在的image_id
+def discover_image_ids():
+    """自动发现所有可能存在的image_id"""
     dat_files = glob.glob(".\\meta_data\\**\\REFLECTANCE_*.dat", recursive=True)
-    image_ids = list(set(re.findall(r"REFLECTANCE_(\d+)\.dat", f)[0] for f in dat_files))
+    return sorted(set(re.findall(r"REFLECTANCE_(\d+)\.dat", f)[0] for f in dat_files))
+
+
+def batch_process(backend="rasterio", executor=None, workers=2, use_cache=True, sampling="point"):
+    """
+    批量处理所有有效图像ID
+    executor=None 为串行处理；"thread" 使用线程池预取后续ID的反射率，主线程按顺序写出结果；
+    "process" 使用进程池，每个进程独立完成读取与写出。
+    use_cache为True时依据 results/.manifest.json 跳过输入与参数均未变化的ID。
+    sampling为 "point"（中心点单像元）或 "region"（按区域标签图统计）。
+    """
+    image_ids = discover_image_ids()
 
     logger.info(f"找到 {len(image_ids)} 个待处理图像ID")
+    start_time = time.time()
+
+    manifest = RunManifest(os.path.join(".\\results", ".manifest.json")) if use_cache else None
+    skipped = []
+    if manifest is not None:
+        skipped = [
+            image_id for image_id in image_ids if is_reflectance_fresh(image_id, manifest, sampling=sampling)
+            ]
+        image_ids = [image_id for image_id in image_ids if image_id not in skipped]
+        if skipped:
+            logger.info(f"{len(skipped)} 个图像ID输入与参数未发生变化，沿用已有结果：{', '.join(skipped)}")
+
+    outcomes = []
+    if executor == "thread" and image_ids:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            # 最多保持workers个ID在读取中，写出当前结果时后续数据立方体已在后台读取
+            pending = deque()
+            id_iter = iter(image_ids)
+            for image_id in islice(id_iter, workers):
+                pending.append((image_id, pool.submit(load_data, image_id, backend=backend, sampling=sampling)))
+            while pending:
+                image_id, future = pending.popleft()
+                for next_id in islice(id_iter, 1):
+                    pending.append((next_id, pool.submit(load_data, next_id, backend=backend, sampling=sampling)))
+                loaded = future.result()
+                outcomes.append(loaded is not None and save_reflectance(loaded[1], loaded[0], image_id))
+    elif executor == "process" and image_ids:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            outcomes = list(pool.map(
+                    process_data, image_ids, repeat(".\\results"), repeat(59), repeat(backend), repeat(None),
+                    repeat(sampling)
+                    ))
+    else:
+        outcomes = [process_data(image_id, backend=backend, sampling=sampling) for image_id in image_ids]
+
+    if manifest is not None:
+        for image_id, succeeded in zip(image_ids, outcomes):
+            if succeeded:
+                record_reflectance(image_id, manifest, sampling=sampling)
+        manifest.save()
 
-    for image_id in image_ids:
-        process_data(image_id)
+    elapsed = time.time() - start_time
+    throughput = len(image_ids) / elapsed if elapsed > 0 else 0.0
+    logger.info(
+            f"反射率提取汇总：成功 {sum(outcomes)}/{len(image_ids)} 个（另跳过 {len(skipped)} 个），耗时 {elapsed:.1f}秒，"
+            f"吞吐量 {throughput:.2f} 张/秒"
+            )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,110 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+
+# 获取全局logger
+logger = logging.getLogger("app_logger")
+
+
+def file_digest(file_path, chunk_size=1 << 20):
+    """分块计算文件内容的SHA-256摘要"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file_obj:
+        for chunk in iter(lambda: file_obj.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_signature(file_path, previous=None):
+    """生成文件签名；大小与修改时间未变时沿用上次的摘要，避免重复读取大文件"""
+    stat = os.stat(file_path)
+    if previous and previous.get("size") == stat.st_size and previous.get("mtime_ns") == stat.st_mtime_ns:
+        return previous
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": file_digest(file_path)}
+
+
+class RunManifest:
+    """
+    持久化的处理清单（默认 results/.manifest.json）
+    按 阶段/ID 记录输入、输出文件的内容摘要和处理参数，二者均未变化时可跳过重复计算。
+    """
+
+    def __init__(self, manifest_path):
+        self.manifest_path = manifest_path
+        self.lock = threading.Lock()
+        self.entries = self._load()
+        # 本次运行已计算的文件签名（is_fresh 与 record 共用，大小与修改时间未变时不再重复计算摘要）
+        self.signatures = {}
+
+    def _load(self):
+        """读取清单文件，不存在或损坏时返回空清单"""
+        if not os.path.exists(self.manifest_path):
+            return {}
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as manifest_file:
+                return json.load(manifest_file)
+        except (OSError, ValueError) as e:
+            logger.warning(f"处理清单读取失败，将重新计算全部结果：{str(e)}")
+            return {}
+
+    def _signatures_match(self, recorded, file_paths):
+        """逐个比较文件签名；内容未变而仅修改时间变化时刷新记录的签名"""
+        if sorted(recorded) != sorted(file_paths):
+            return False
+        for file_path in file_paths:
+            if not os.path.exists(file_path):
+                return False
+            signature = file_signature(file_path, recorded[file_path])
+            self.signatures[file_path] = signature
+            if signature["sha256"] != recorded[file_path]["sha256"]:
+                return False
+            recorded[file_path] = signature
+        return True
+
+    def is_fresh(self, stage, key, inputs, outputs, params):
+        """判断某ID的结果是否为最新（参数、输入与输出均与记录一致）"""
+        with self.lock:
+            entry = self.entries.get(stage, {}).get(key)
+            if entry is None or entry.get("params") != params:
+                return False
+            return self._signatures_match(entry["inputs"], inputs) and self._signatures_match(entry["outputs"], outputs)
+
+    def get_meta(self, stage, key):
+        """读取某ID记录的附加信息"""
+        with self.lock:
+            return self.entries.get(stage, {}).get(key, {}).get("meta", {})
+
+    def _previous_signatures(self, stage, key):
+        """汇总可复用的文件签名：本次运行已计算的签名优先，其次为该ID上次记录的签名"""
+        previous = {}
+        entry = self.entries.get(stage, {}).get(key) or {}
+        for section in ("inputs", "outputs"):
+            previous.update(entry.get(section, {}))
+        previous.update(self.signatures)
+        return previous
+
+    def record(self, stage, key, inputs, outputs, params, meta=None):
+        """记录某ID本次处理的输入、输出签名与参数（大小与修改时间未变的文件沿用已有摘要）"""
+        with self.lock:
+            previous = self._previous_signatures(stage, key)
+        signatures = {file_path: file_signature(file_path, previous.get(file_path)) for file_path in {*inputs, *outputs}}
+        entry = {
+            "params": params,
+            "inputs": {file_path: signatures[file_path] for file_path in inputs},
+            "outputs": {file_path: signatures[file_path] for file_path in outputs},
+            "meta": meta or {}
+            }
+        with self.lock:
+            self.signatures.update(signatures)
+            self.entries.setdefault(stage, {})[key] = entry
+
+    def save(self):
+        """原子写入清单文件"""
+        with self.lock:
+            os.makedirs(os.path.dirname(self.manifest_path) or ".", exist_ok=True)
+            temp_path = self.manifest_path + ".tmp"
+            with open(temp_path, "w", encoding="utf-8") as manifest_file:
+                json.dump(self.entries, manifest_file, ensure_ascii=False, indent=2)
+            os.replace(temp_path, self.manifest_path)
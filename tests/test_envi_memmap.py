@@ -0,0 +1,91 @@
+"""ENVI内存映射读取与rasterio窗口读取的一致性检查（合成数据立方体写入临时目录）"""
+import numpy as np
+import pytest
+
+from obtain_reflectance import open_envi_memmap, sample_memmap, sample_rasterio
+
+HEIGHT, WIDTH, BANDS = 37, 53, 6
+
+# ENVI数据类型编号
+ENVI_TYPE_CODES = {np.dtype(np.int16): 2, np.dtype(np.float32): 4, np.dtype(np.float64): 5}
+
+
+def write_envi_cube(tmp_path, cube, interleave, byte_order=0, name="cube"):
+    """将(波段, 行, 列)数组按指定交织方式与字节序写出为 .dat/.hdr，返回.dat路径"""
+    layout = {"bsq": (0, 1, 2), "bil": (1, 0, 2), "bip": (1, 2, 0)}[interleave]
+    dtype = cube.dtype.newbyteorder(">" if byte_order else "<")
+    dat_path = tmp_path / f"{name}.dat"
+    np.ascontiguousarray(cube.transpose(layout)).astype(dtype).tofile(dat_path)
+    bands, lines, samples = cube.shape
+    (tmp_path / f"{name}.hdr").write_text(
+            "ENVI\n"
+            f"samples = {samples}\nlines   = {lines}\nbands   = {bands}\n"
+            "header offset = 0\nfile type = ENVI Standard\n"
+            f"data type = {ENVI_TYPE_CODES[cube.dtype]}\ninterleave = {interleave}\nbyte order = {byte_order}\n"
+            "band names = {\n Band 1, Band 2, Band 3,\n Band 4, Band 5, Band 6}\n"
+            )
+    return str(dat_path)
+
+
+def synthetic_cube(dtype, seed=0):
+    """生成随机合成立方体（波段, 行, 列）"""
+    rng = np.random.default_rng(seed)
+    if np.dtype(dtype).kind == "f":
+        return rng.random((BANDS, HEIGHT, WIDTH)).astype(dtype)
+    return rng.integers(-3000, 3000, (BANDS, HEIGHT, WIDTH)).astype(dtype)
+
+
+def random_points(count=200, seed=1):
+    """随机（无序、含重复与边缘像元）的(行, 列)坐标"""
+    rng = np.random.default_rng(seed)
+    points = np.column_stack([rng.integers(0, HEIGHT, count), rng.integers(0, WIDTH, count)])
+    corners = [(0, 0), (HEIGHT - 1, WIDTH - 1), (0, WIDTH - 1), (HEIGHT - 1, 0)]
+    return np.vstack([points, corners, points[:10]])
+
+
+@pytest.mark.parametrize("interleave", ["bsq", "bil", "bip"])
+@pytest.mark.parametrize("byte_order", [0, 1])
+@pytest.mark.parametrize("dtype", [np.float32, np.int16])
+def test_memmap_matches_rasterio(tmp_path, interleave, byte_order, dtype):
+    cube = synthetic_cube(dtype)
+    dat_path = write_envi_cube(tmp_path, cube, interleave, byte_order)
+    points = random_points()
+
+    memmap_data = sample_memmap(dat_path, points, "test")
+    rasterio_data = sample_rasterio(dat_path, points, "test", window_size=16)
+
+    np.testing.assert_array_equal(memmap_data, rasterio_data)
+    np.testing.assert_array_equal(memmap_data, cube[:, points[:, 0], points[:, 1]].T)
+    # 结果统一为本机字节序
+    assert memmap_data.dtype == np.dtype(dtype)
+
+
+def test_bsq_sorted_access_restores_point_order(tmp_path):
+    cube = synthetic_cube(np.float32, seed=3)
+    dat_path = write_envi_cube(tmp_path, cube, "bsq")
+    # 逆序排列的坐标：BSQ分支按行优先排序读取后需恢复原顺序
+    points = np.array([(r, c) for r in range(HEIGHT - 1, -1, -4) for c in range(WIDTH - 1, -1, -5)])
+
+    np.testing.assert_array_equal(sample_memmap(dat_path, points, "test"), cube[:, points[:, 0], points[:, 1]].T)
+    np.testing.assert_array_equal(
+            sample_memmap(dat_path, points, "test"), sample_rasterio(dat_path, points, "test", window_size=8)
+            )
+
+
+def test_big_endian_header_is_honoured(tmp_path):
+    cube = synthetic_cube(np.float32, seed=4)
+    dat_path = write_envi_cube(tmp_path, cube, "bip", byte_order=1)
+    memmap_cube, interleave = open_envi_memmap(dat_path)
+
+    assert interleave == "bip"
+    assert memmap_cube.dtype.byteorder == ">"
+    np.testing.assert_array_equal(memmap_cube.transpose(2, 0, 1), cube)
+
+
+@pytest.mark.parametrize("point", [(-1, 0), (0, WIDTH), (HEIGHT, 0)])
+def test_out_of_bounds_points_return_none(tmp_path, point):
+    dat_path = write_envi_cube(tmp_path, synthetic_cube(np.float32), "bil")
+    points = np.array([(1, 1), point])
+
+    assert sample_memmap(dat_path, points, "test") is None
+    assert sample_rasterio(dat_path, points, "test") is None